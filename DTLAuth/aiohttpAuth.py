@@ -1,24 +1,28 @@
 import json
-from pathlib import Path
 from aiohttp import web
 from DTLAuth.utils import AUTH_CALLBACK_TYPE, handle_auth_request
+from DTLAuth.assetCache import assets
 from helpers import misc
 
 _on_resource_auth_callback = None
 
-STATIC_FOLDER = Path(__file__).parent / 'web/public'
-TEMPLATE_FOLDER = Path(__file__).parent / 'web/templates'
-
 app = web.Application()
 routes = web.RouteTableDef()
 
-routes.static('/public', STATIC_FOLDER)
+def asset_response(request: web.Request):
+    asset = assets.get(request.path)
+    if asset is None: raise web.HTTPNotFound()
+
+    status, headers, body = asset.response({key.lower(): value for key, value in request.headers.items()})
+    return web.Response(status=status, body=body, headers=headers)
 
 @routes.get('/')
 async def web_root(request: web.Request):
-    with open(TEMPLATE_FOLDER / 'index.html', 'r') as f:
-        ROOT_HTML_RESP = f.read()
-    return web.Response(text=ROOT_HTML_RESP, content_type='text/html')
+    return asset_response(request)
+
+@routes.get('/public/{path:.*}')
+async def web_public(request: web.Request):
+    return asset_response(request)
 
 @routes.post('/api/auth-resource')
 async def api_web_auth_resource(request: web.Request):
@@ -38,6 +42,7 @@ runner = web.AppRunner(app)
 async def start_web(port: int, on_resource_auth_callback: AUTH_CALLBACK_TYPE):
     global _on_resource_auth_callback
     _on_resource_auth_callback = on_resource_auth_callback
+    assets.start()
 
     await runner.setup()
     site = web.TCPSite(runner=runner, host='0.0.0.0', port=port)
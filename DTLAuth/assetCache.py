@@ -0,0 +1,104 @@
+import asyncio, gzip, hashlib, logging, mimetypes, email.utils
+from pathlib import Path
+from DTLAuth.utils import STATIC_FOLDER, TEMPLATE_FOLDER
+from helpers import misc
+
+try: import brotli
+except ImportError: brotli = None
+
+logger = logging.getLogger(__name__)
+
+ASSET_RELOAD_INTERVAL = 5
+PUBLIC_CACHE_CONTROL = 'public, max-age=86400'
+TEMPLATE_CACHE_CONTROL = 'no-cache'
+
+class Asset:
+    def __init__(self, file: Path, data: bytes, mtime: float, cache_control: str) -> None:
+        self.file = file
+        self.mtime = mtime
+        self.cache_control = cache_control
+        self.mime = mimetypes.guess_type(file)[0] or 'application/octet-stream'
+        if self.mime.startswith('text/') or self.mime in ['application/javascript', 'application/json']: self.mime += '; charset=utf-8'
+
+        self.data = data
+        self.etag = f'"{hashlib.sha1(data).hexdigest()[:16]}"'
+        self.last_modified = email.utils.formatdate(mtime, usegmt=True)
+
+        self.encodings: dict[str, bytes] = {}
+        gzipped = gzip.compress(data, 9, mtime=0)
+        if len(gzipped) < len(data): self.encodings['gzip'] = gzipped
+        if brotli is not None:
+            compressed = brotli.compress(data)
+            if len(compressed) < len(data): self.encodings['br'] = compressed
+
+    def not_modified(self, headers: dict[str, str]) -> bool:
+        if_none_match = headers.get('if-none-match', None)
+        if if_none_match is not None:
+            return any(tag.strip() in [self.etag, f'W/{self.etag}', '*'] for tag in if_none_match.split(','))
+
+        if_modified_since = headers.get('if-modified-since', None)
+        if if_modified_since is None: return False
+        try: since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except Exception: return False
+        return int(self.mtime) <= since
+
+    def response(self, headers: dict[str, str]) -> tuple[int, dict[str, str], bytes]:
+        response_headers = {
+            'ETag': self.etag,
+            'Last-Modified': self.last_modified,
+            'Cache-Control': self.cache_control,
+            'Vary': 'Accept-Encoding'
+        }
+
+        # a 304 only carries validators and cache headers, no entity headers describing a body
+        if self.not_modified(headers): return 304, response_headers, b''
+
+        response_headers['Content-Type'] = self.mime
+
+        accepted = [item.split(';')[0].strip().lower() for item in headers.get('accept-encoding', '').split(',')]
+        for encoding in ['br', 'gzip']:
+            if encoding in accepted and encoding in self.encodings:
+                response_headers['Content-Encoding'] = encoding
+                return 200, response_headers, self.encodings[encoding]
+
+        return 200, response_headers, self.data
+
+class AssetCache:
+    def __init__(self) -> None:
+        self.assets: dict[str, Asset] = {}
+        self.watching = False
+
+    def get(self, path: str) -> Asset | None:
+        return self.assets.get(path.split('?', 1)[0], None)
+
+    def load(self):
+        files: dict[str, tuple[Path, str]] = {'/': (TEMPLATE_FOLDER / 'index.html', TEMPLATE_CACHE_CONTROL)}
+        for file in STATIC_FOLDER.rglob('*'):
+            if file.is_file(): files['/public/' + file.relative_to(STATIC_FOLDER).as_posix()] = (file, PUBLIC_CACHE_CONTROL)
+
+        assets: dict[str, Asset] = {}
+        for path, (file, cache_control) in files.items():
+            try:
+                mtime = file.stat().st_mtime
+                current = self.assets.get(path, None)
+                if current is not None and current.file == file and current.mtime == mtime:
+                    assets[path] = current
+                    continue
+                assets[path] = Asset(file, file.read_bytes(), mtime, cache_control)
+            except Exception as e:
+                logger.error(f'Failed to load asset {file}: {str(e)}')
+
+        self.assets = assets
+
+    def start(self):
+        if self.watching: return
+        self.watching = True
+        self.load()
+        misc.queue_task(self.watch())
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(ASSET_RELOAD_INTERVAL)
+            self.load()
+
+assets = AssetCache()
@@ -1,97 +1,139 @@
-import http.server, socketserver, json, threading, asyncio, logging
-from concurrent.futures import TimeoutError as FutureTimeout
-from DTLAuth.utils import STATIC_FOLDER, TEMPLATE_FOLDER, AUTH_CALLBACK_TYPE, handle_auth_request, static_resolver
-from helpers import misc
+import asyncio, json, logging, datetime
+from DTLAuth.utils import AUTH_CALLBACK_TYPE, handle_auth_request
+from DTLAuth.assetCache import assets
+from helpers import SocketWrapper, misc, create_host
 
 logger = logging.getLogger(__name__)
 
-class BasicHttpHandler(http.server.SimpleHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            with open(TEMPLATE_FOLDER / 'index.html', 'r') as f:
-                self.wfile.write(f.read().encode())
-        elif self.path.startswith('/public'):
-            mime_type = None
-            content = None
-            try:
-                mime_type, content = static_resolver(self.path)
-            except Exception:
-                pass
-
-            if content == None or mime_type == None:
-                self.send_error(404, 'File path invalid')
-                return
-
-            encoded_content = None
-            try:
-                encoded_content = content.encode() if isinstance(content, str) else content
-            except Exception:
-                pass
-
-            if encoded_content == None:
-                self.send_error(404, 'File read error')
-                return
-
-            self.send_response(200)
-            self.send_header('Content-type', mime_type)
-            self.end_headers()
-            self.wfile.write(encoded_content)
-        else:
-            logger.warning(f'Unhandled url path: {self.path}')
-            self.send_error(404, "Unknown endpoint")
-
-    def do_POST(self):
-        if self.path == '/api/auth-resource':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            try:
-                data = json.loads(post_data)
-            except:
-                self._json_response({'statusMessage': 'Failed to read data'})
-                return
-
-            ip = misc.get_ip(dict(self.headers), [self.client_address[0]])
-
-            future = asyncio.run_coroutine_threadsafe(handle_auth_request(ip, data, _on_resource_auth_callback), _event_loop)
-            resolvedAuth = None
-
-            try:
-                resolvedAuth = future.result(10)
-            except FutureTimeout:
-                self._json_response({'statusMessage': 'Auth timeout'})
-                return
-            except Exception as e:
-                logger.error(f'Failed to handle auth request callback: {str(e)}')
-                self._json_response({'statusMessage': 'Auth error'})
-                return
-            
-            self._json_response({'statusMessage': resolvedAuth[1]})
-        else:
-            self.send_error(404, "Unknown endpoint")
-
-    def _json_response(self, data):
-        response = json.dumps(data).encode()
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Content-length', str(len(response)))
-        self.end_headers()
-        self.wfile.write(response)
+KEEP_ALIVE_TIMEOUT = 15
+MAX_BODY_SIZE = 64 * 1024
 
-async def start_web(port: int, on_resource_auth_callback: AUTH_CALLBACK_TYPE):
-    global _on_resource_auth_callback, _event_loop
+STATUS_TEXT = {
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large'
+}
+
+_on_resource_auth_callback: AUTH_CALLBACK_TYPE = None
+
+class Request:
+    def __init__(self, method: str, path: str, version: str, headers: dict[str, str], body: bytes, ip: str | None) -> None:
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers
+        self.body = body
+        self.ip = ip
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0': return connection == 'keep-alive'
+        return connection != 'close'
+
+def build_response(status: int, body: bytes, content_type: str | None, keep_alive: bool, headers: dict[str, str] | None = None) -> bytes:
+    utctime = datetime.datetime.now(datetime.timezone.utc).strftime('%a, %d %b %Y %H:%M:%S GMT')
+    entity = '' if status == 304 else f'Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n'
+    extra = ''.join(f'{key}: {value}\r\n' for key, value in (headers or {}).items() if key != 'Content-Type')
+    head = f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "OK")}\r\nServer: Yazaar-DTL-server\r\nDate: {utctime}\r\n{entity}{extra}Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'
+    return head.encode('utf-8') + body
+
+def json_response(data: dict, keep_alive: bool) -> bytes:
+    return build_response(200, json.dumps(data).encode('utf-8'), 'application/json', keep_alive)
+
+def error_response(status: int, message: str, keep_alive: bool = False) -> bytes:
+    return build_response(status, message.encode('utf-8'), 'text/plain; charset=utf-8', keep_alive)
+
+async def read_body(connection: SocketWrapper, size: int) -> bytes | None:
+    body = b''
+    while len(body) < size:
+        chunk = await connection.read_size(size - len(body))
+        if not chunk: return None
+        body += chunk
+
+    if len(body) > size:
+        connection.push_back(body[size:])
+        body = body[:size]
+    return body
+
+async def read_request(connection: SocketWrapper) -> Request | None:
+    raw_head = await connection.read_until(b'\r\n\r\n')
+    if not raw_head: return None
+
+    request_line, _, raw_headers = raw_head.partition(b'\r\n')
+    parts = request_line.decode('latin-1').split(' ')
+    if len(parts) != 3: raise ValueError('Invalid request line')
+
+    method, path, version = parts
+    headers = misc.get_http_headers(raw_headers)
+
+    size = misc.to_int(headers.get('content-length', '0'), None)
+    if size is None or size < 0: raise ValueError('Invalid Content-Length')
+    if size > MAX_BODY_SIZE: raise OverflowError('Body too large')
+
+    body = await read_body(connection, size) if size else b''
+    if body is None: return None
 
+    return Request(method, path, version, headers, body, misc.get_ip(headers, [connection.ip]))
+
+async def handle_request(request: Request) -> bytes:
+    keep_alive = request.keep_alive
+
+    asset = assets.get(request.path) if request.method in ['GET', 'HEAD'] else None
+    if asset is not None:
+        status, headers, body = asset.response(request.headers)
+        response = build_response(status, body, headers.get('Content-Type', None), keep_alive, headers)
+        if request.method == 'HEAD': response = response[:len(response) - len(body)]
+        return response
+
+    if request.method == 'GET' and request.path.startswith('/public'):
+        return error_response(404, 'File path invalid', keep_alive)
+
+    if request.path == '/api/auth-resource':
+        if request.method != 'POST': return error_response(405, 'Method not allowed', keep_alive)
+
+        try: data = json.loads(request.body)
+        except Exception: return json_response({'statusMessage': 'Failed to read data'}, keep_alive)
+
+        try: result = await handle_auth_request(request.ip, data, _on_resource_auth_callback)
+        except Exception as e:
+            logger.error(f'Failed to handle auth request callback: {str(e)}')
+            return json_response({'statusMessage': 'Auth error'}, keep_alive)
+
+        return json_response({'statusMessage': result[1]}, keep_alive)
+
+    logger.warning(f'Unhandled url path: {request.path}')
+    return error_response(404, 'Unknown endpoint', keep_alive)
+
+async def on_client(connection: SocketWrapper):
+    try:
+        while connection.isOpen:
+            try: request = await asyncio.wait_for(read_request(connection), KEEP_ALIVE_TIMEOUT)
+            except asyncio.TimeoutError: break
+            except OverflowError:
+                connection.write(error_response(413, 'Body too large'))
+                break
+            except ValueError:
+                connection.write(error_response(400, 'Bad request'))
+                break
+
+            if request is None: break
+
+            connection.write(await handle_request(request))
+            await connection.flush()
+            if not request.keep_alive: break
+        await connection.flush()
+    except Exception: pass
+    connection.close()
+
+async def start_web(port: int, on_resource_auth_callback: AUTH_CALLBACK_TYPE):
+    global _on_resource_auth_callback
     _on_resource_auth_callback = on_resource_auth_callback
-    _event_loop = asyncio.get_running_loop()
-    handler = BasicHttpHandler
-    handler.directory = str(STATIC_FOLDER.parent)
-
-    def runner():
-        with socketserver.TCPServer(('0.0.0.0', port), handler) as server:
-            logger.info(f'Running on port {port}')
-            server.serve_forever()
-    
-    thread = threading.Thread(target=runner, daemon=True)
-    thread.start()
+    assets.start()
+
+    host = create_host('0.0.0.0', port, on_client, None)
+    await host.start()
+    logger.info(f'Running on port {port}')
@@ -0,0 +1,44 @@
+import time
+from collections import OrderedDict, deque
+
+AUTH_IP_LIMIT = 10
+AUTH_RESOURCE_LIMIT = 30
+AUTH_VISITOR_LIMIT = 5
+AUTH_WINDOW = 60
+RATE_LIMIT_KEYS = 10000
+
+class SlidingWindowLimiter:
+    def __init__(self, limit: int, window: float, max_keys: int = RATE_LIMIT_KEYS) -> None:
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.hits: OrderedDict[str, deque[float]] = OrderedDict()
+
+    def allow(self, key: str) -> bool:
+        '''Count an attempt for key, False once the limit is reached within the window'''
+        if self.limited(key): return False
+        self.record(key)
+        return True
+
+    def limited(self, key: str) -> bool:
+        '''True when key reached the limit within the window, does not count an attempt'''
+        hits = self.hits.get(key, None)
+        if hits is None: return False
+
+        now = time.monotonic()
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+        if not hits:
+            self.hits.pop(key)
+            return False
+        return len(hits) >= self.limit
+
+    def record(self, key: str):
+        hits = self.hits.get(key, None)
+        if hits is None:
+            hits = self.hits[key] = deque()
+            while len(self.hits) > self.max_keys:
+                self.hits.popitem(last=False)
+        else:
+            self.hits.move_to_end(key)
+        hits.append(time.monotonic())
@@ -1,11 +1,19 @@
-import typing, mimetypes
+import typing
 from pathlib import Path
+from DTLAuth.rateLimit import SlidingWindowLimiter, AUTH_IP_LIMIT, AUTH_RESOURCE_LIMIT, AUTH_VISITOR_LIMIT, AUTH_WINDOW
 
-AUTH_CALLBACK_TYPE = typing.Optional[typing.Callable[[str, str, str, str], typing.Awaitable[bool]]]
+# resolves to None when the resource does not exist, otherwise whether the code was accepted
+AUTH_CALLBACK_TYPE = typing.Optional[typing.Callable[[str, str, str, str], typing.Awaitable[bool | None]]]
 
 STATIC_FOLDER = Path(__file__).parent / 'web/public'
 TEMPLATE_FOLDER = Path(__file__).parent / 'web/templates'
 
+AUTH_STATS = {'accepted': 0, 'rejected': 0, 'limited': 0}
+
+ip_limiter = SlidingWindowLimiter(AUTH_IP_LIMIT, AUTH_WINDOW)
+resource_limiter = SlidingWindowLimiter(AUTH_RESOURCE_LIMIT, AUTH_WINDOW)
+visitor_limiter = SlidingWindowLimiter(AUTH_VISITOR_LIMIT, AUTH_WINDOW)
+
 async def handle_auth_request(ip: str | None, data: dict[str, str], onResourceAuthCallback: AUTH_CALLBACK_TYPE) -> tuple[bool, str]:
     if not onResourceAuthCallback:
         return False, 'Auth not configured'
@@ -13,6 +21,10 @@ async def handle_auth_request(ip: str | None, data: dict[str, str], onResourceAu
     if not ip:
         return False, 'Invalid IP'
 
+    if not ip_limiter.allow(ip):
+        AUTH_STATS['limited'] += 1
+        return False, 'Too many attempts'
+
     if not isinstance(data, dict):
         return False, 'Invalid data'
 
@@ -23,35 +35,20 @@ async def handle_auth_request(ip: str | None, data: dict[str, str], onResourceAu
     if not isinstance(resourceType, str) or not isinstance(resourceItem, str) or not isinstance(resourceCode, str):
         return False, 'Invalid message'
 
+    # only wrong codes for existing resources count, per resource (caps attempts spread over many IPs) and per visitor
+    resourceKey = f'{resourceType}:{resourceItem}'
+    visitorKey = f'{ip}:{resourceKey}'
+    if resource_limiter.limited(resourceKey) or visitor_limiter.limited(visitorKey):
+        AUTH_STATS['limited'] += 1
+        return False, 'Too many attempts'
+
     resolvedAuth = await onResourceAuthCallback(ip, resourceType, resourceItem, resourceCode)
     if resolvedAuth:
+        AUTH_STATS['accepted'] += 1
         return True, 'Access provided'
     else:
+        if resolvedAuth is not None:
+            resource_limiter.record(resourceKey)
+            visitor_limiter.record(visitorKey)
+        AUTH_STATS['rejected'] += 1
         return False, 'Access blocked'
-
-def static_resolver(path: str) -> tuple[str, str | bytes | None]:
-    if not path.startswith('/public/'):
-        raise Exception('File access illegal')
-
-    target = path[8:]
-    full_path = STATIC_FOLDER / target
-
-    if (not full_path.is_relative_to(STATIC_FOLDER)) or (not full_path.is_file()):
-        raise Exception('File access illegal')
-
-    mime = mimetypes.guess_type(full_path)[0]
-    if not mime: mime = 'application/octet-stream'
-
-    read_mode = 'r' if mime.startswith('text/') else 'rb'
-    enc_mode = 'utf-8' if read_mode else None
-
-    data = None
-
-    try:
-        with open(full_path, read_mode, encoding=enc_mode) as f:
-            data = f.read()
-    except Exception:
-        pass
-
-    return mime, data
-
@@ -1,6 +1,10 @@
 import asyncio, datetime, uuid, logging, typing
-from helpers import SocketWrapper, SocketRegistry, misc
-from helpers.socketHost import create_host
+from helpers import SocketWrapper, SocketRegistry, IPAllowlist, misc, secretHash, relay
+from helpers.socketHost import create_host, SocketHost
+from helpers.taskScope import TaskScope, root
+from helpers.ipAllowlist import ALLOWLIST_TTL, ALLOWLIST_SIZE
+from helpers.socketOptions import SocketOptions
+from helpers.controlChannel import ChannelConnection
 
 logger = logging.getLogger(__name__)
 
@@ -8,31 +12,65 @@ REQUEST_TIMEOUT = 90
 PING_INTERVAL = 15
 PING_TIMEOUT = 60
 MAX_POOLS = 5
+UDP_POOL_MAX_BUFFER = 1024 * 1024
+SESSION_GRACE = 30
+MAX_HEALTHY_RTT = 5
+BALANCE_LEAST_CONNECTIONS = 'least'
+BALANCE_WEIGHTED = 'weighted'
+BAD_GATEWAY_PAGE = '<h1>Bad gateway</h1><p>The tunnel client could not reach the application</p>'
+BUSY_PAGE = '<h1>Service unavailable</h1><p>Too many concurrent connections, try again later</p>'
+
+REQUEST_STATS = {'rejected': 0, 'timed_out': 0, 'limited': 0, 'udp_dropped': 0}
+
+class Binding:
+    def __init__(self, connection: SocketWrapper, weight: int, tasks: TaskScope) -> None:
+        self.connection = connection
+        self.weight = max(1, weight)
+        self.tasks = tasks
+        self.sessionId = str(uuid.uuid4())
+        self.session_expiry: asyncio.Task | None = None
+        self.lastPong = datetime.datetime.now()
+        self.lastPing: datetime.datetime | None = None
+        self.rtt: float | None = None
+        self.active = 0
+        self.current_weight = 0
+
+    @property
+    def isOpen(self): return bool(self.connection.isOpen)
+
+    @property
+    def healthy(self):
+        if not self.isOpen: return False
+        link = self.connection.channel if isinstance(self.connection, ChannelConnection) else self
+        if link.rtt is not None and link.rtt > MAX_HEALTHY_RTT: return False
+        if link.lastPing and link.lastPing > link.lastPong and misc.seconds_since(link.lastPing) > MAX_HEALTHY_RTT: return False
+        return True
 
 class GenericHost:
-    def __init__(self, host_type: str, con: str, sha256hex: str, salt: str) -> None:
+    def __init__(self, host_type: str, con: str, sha256hex: str, salt: str, options: dict[str, str] | None = None) -> None:
         self.host_type = host_type
-
-        self.con = con
-
-        if self.host_type in ['tcp', 'udp']:
-            con_int = misc.to_int(self.con, None)
-            if con_int is None: raise ValueError(f'Host-type {self.host_type} require target to be of type int')
-            self.con = con_int
-
-        self.sha256hex = sha256hex
-        self.salt = salt
-        self.host = create_host('0.0.0.0', self.con, self.on_client, self.on_message, protocol=self.host_type) if isinstance(self.con, int) and self.host_type in ['tcp', 'udp'] else None
-        self.binding: SocketWrapper | None = None
-        self.lastPong = datetime.datetime.now()
-        self.sessionId: str | None = None
+        self.con: str | int = GenericHost.validate(host_type, con, options)
+
+        self.sha256hex = ''
+        self.salt = ''
+        self.max_clients = 1
+        self.balance = BALANCE_LEAST_CONNECTIONS
+        self.allowlist = IPAllowlist()
+        self.host: SocketHost | None = None
+        self.configure(sha256hex, salt, options)
+
+        self.tasks = root.child(f'{self.host_type} {self.con}')
+        self.host = create_host('0.0.0.0', self.con, self.on_client, self.on_message, protocol=self.host_type, tasks=self.tasks, socket_options=self.socket_options) if isinstance(self.con, int) and self.host_type in ['tcp', 'udp'] else None
+        self.bindings: list[Binding] = []
         self.auth = ''
 
-        self.accepted: list[str] = []
-
         self.pendings: list[SocketWrapper] = []
 
         self.request_ids: list[str] = []
+        self.request_timeouts: dict[str, asyncio.TimerHandle] = {}
+        self.assigned: dict[str, Binding] = {}
+
+        self.relaying = 0
 
         self.pool_index = -1
         self.pool: list[SocketWrapper] = []
@@ -40,6 +78,69 @@ class GenericHost:
         self.registry = SocketRegistry()
         self.pool_registry = SocketRegistry(MAX_POOLS * 2)
 
+    @staticmethod
+    def validate(host_type: str, con: str, options: dict[str, str] | None = None) -> str | int:
+        options = options or {}
+
+        balance = options.get('balance') or BALANCE_LEAST_CONNECTIONS
+        if balance not in [BALANCE_LEAST_CONNECTIONS, BALANCE_WEIGHTED]:
+            raise ValueError(f'Invalid balance {balance} for {host_type} {con}')
+
+        secretHash.validate(options.get('kdf') or secretHash.KDF_SHA256, options.get('kdfParams') or '')
+
+        try: IPAllowlist().set_prefixes((options.get('allow') or '').split(';'))
+        except ValueError: raise ValueError(f'Invalid allow {options.get("allow")} for {host_type} {con}')
+
+        try: SocketOptions.parse(options)
+        except ValueError as e: raise ValueError(f'{str(e)} for {host_type} {con}')
+
+        if host_type in ['tcp', 'udp']:
+            con_int = misc.to_int(con, None)
+            if con_int is None: raise ValueError(f'Host-type {host_type} require target to be of type int')
+            return con_int
+        return con
+
+    def configure(self, sha256hex: str, salt: str, options: dict[str, str] | None = None):
+        GenericHost.validate(self.host_type, str(self.con), options)
+        options = options or {}
+
+        self.options = options
+        self.sha256hex = sha256hex
+        self.salt = salt
+        self.max_clients = misc.to_int(options.get('maxClients'), None) or 1
+        self.balance = options.get('balance') or BALANCE_LEAST_CONNECTIONS
+        self.kdf = options.get('kdf') or secretHash.KDF_SHA256
+        self.kdf_params = options.get('kdfParams') or ''
+        self.allowlist.ttl = misc.to_int(options.get('allowTTL'), None) or ALLOWLIST_TTL
+        self.allowlist.max_size = misc.to_int(options.get('allowSize'), None) or ALLOWLIST_SIZE
+        self.allowlist.set_prefixes((options.get('allow') or '').split(';'))
+        self.socket_options = SocketOptions.parse(options)
+        if self.host: self.host.socket_options = self.socket_options
+        self.idle_timeout = misc.to_int(options.get('idleTimeout'), None) or 0
+        self.max_streams = misc.to_int(options.get('maxStreams'), None) or 0
+
+    @property
+    def streams(self):
+        return len(self.request_timeouts) + self.relaying
+
+    def is_idle(self):
+        if self.bindings or self.pool or self.assigned or self.request_ids or self.relaying: return False
+        return not (self.host and self.host.running)
+
+    async def shutdown(self):
+        for binding in list(self.bindings):
+            await self.__remove_binding(binding)
+
+        if self.host: await self.host.stop()
+
+        for connection in list(self.pool):
+            connection.close()
+
+        for identifier in list(self.request_timeouts):
+            self.__drop_request(identifier)
+
+        self.tasks.cancel()
+
     async def auth_request(self, ip: str, resourceCode: str):
         if not self.auth:
             return False
@@ -47,41 +148,50 @@ class GenericHost:
         if not self.auth == resourceCode:
             return False
         
-        if not ip in self.accepted:
-            self.accepted.append(ip)
-        return True
+        return self.allowlist.add(ip)
 
     async def bind(self, data: dict, connection: SocketWrapper):
         isOpen = await self.is_open()
         isVerified = await self.verify(data)
-        if isOpen:
-            if self.binding and self.binding.ip == connection.ip:
-                self.binding.close()
-            else:
-                connection.write(misc.serialize({'code': 'RESOURCE_OCCUPIED', 'message': f'The {self.host_type} {self.con} is occupied by another client'}) + b';')
-                await connection.flush()
-                connection.close()
-                return
-
         if not isVerified:
-            connection.write(misc.serialize({'code': 'AUTHENTICATION_ERROR', 'message': f'Invalid password for {self.host_type} {self.con}'}) + b';')
+            connection.write_frame(misc.serialize({'code': 'AUTHENTICATION_ERROR', 'message': f'Invalid password for {self.host_type} {self.con}', 'type': self.host_type, 'resource': data.get('resource')}) + b';')
             await connection.flush()
             connection.close()
             return
 
-        self.sessionId = str(uuid.uuid4())
-        self.binding = connection
-        self.lastPong = datetime.datetime.now()
+        binding = self.find_binding(data.get('session'))
+        isResume = binding is not None
+        if binding:
+            binding.connection.close()
+            binding.connection = connection
+        else:
+            if not await self.__make_room(connection):
+                connection.write_frame(misc.serialize({'code': 'RESOURCE_OCCUPIED', 'message': f'The {self.host_type} {self.con} is occupied by another client', 'type': self.host_type, 'resource': data.get('resource')}) + b';')
+                await connection.flush()
+                connection.close()
+                return
+            binding = Binding(connection, misc.to_int(data.get('weight'), None) or 1, self.tasks.child('binding'))
+            self.bindings.append(binding)
+
+        if binding.session_expiry:
+            binding.session_expiry.cancel()
+            binding.session_expiry = None
+
+        binding.lastPong = datetime.datetime.now()
+        binding.rtt = None
         self.auth = data.get('auth', '')
-        if not isOpen:
-            self.accepted = []
+        if not isOpen and not isResume and not self.is_resumable():
+            self.allowlist.clear()
 
         if self.host: await self.host.start()
-        connection.write(misc.serialize({'code': 'OK', 'message': f'Successfully bound to {self.host_type} {self.con}'}) + b';')
+        message = f'Resumed session on {self.host_type} {self.con}' if isResume else f'Successfully bound to {self.host_type} {self.con}'
+        connection.write_frame(misc.serialize({'code': 'OK', 'message': message, 'session': binding.sessionId, 'type': self.host_type, 'resource': data.get('resource')}) + b';')
         await connection.flush()
-        listen = self.__listen()
-        ping = self.__ping()
-        await asyncio.gather(listen, ping)
+        await self.__flush_pending_requests()
+        ping = binding.tasks.spawn(self.__ping(binding)) if not isinstance(connection, ChannelConnection) else None
+        try: await self.__listen(binding)
+        finally:
+            if ping: ping.cancel()
 
     async def new_client(self, data: dict, connection: SocketWrapper):
         identifier = data['identifier']
@@ -90,9 +200,20 @@ class GenericHost:
             connection.close()
             return
 
-        data_out = self.__write_worker(client, connection)
-        data_in = self.__write_worker(connection, client)
-        await asyncio.gather(data_out, data_in)
+        timeout = self.request_timeouts.pop(identifier, None)
+        if timeout: timeout.cancel()
+
+        binding = self.assigned.pop(identifier, None)
+        self.socket_options.apply(connection.writer.get_extra_info('socket'), f'{self.host_type} {self.con} bridge')
+        self.relaying += 1
+        try:
+            result = await self.tasks.run(relay(client, connection, self.idle_timeout or None))
+            if result: logger.debug(f'Relayed {result[0]}B in and {result[1]}B out on {self.host_type} {self.con}')
+        finally:
+            self.relaying -= 1
+            if binding: binding.active -= 1
+            client.close()
+            connection.close()
     
     async def add_pool(self, data: dict, connection: SocketWrapper):
         if len(self.pool) >= MAX_POOLS:
@@ -113,41 +234,57 @@ class GenericHost:
         except Exception: pass
 
     async def verify(self, data: dict):
-        if not misc.sha256_match(self.sha256hex, data['secret'], self.salt):
-            return False
-        return True
+        return await secretHash.verify_async(self.sha256hex, data.get('secret'), self.salt, self.kdf, self.kdf_params)
 
     async def is_open(self):
-        return self.binding and self.binding.isOpen
+        return any(binding.isOpen for binding in self.bindings)
+
+    def is_resumable(self):
+        return any(binding.session_expiry is not None for binding in self.bindings)
+
+    def find_binding(self, sessionId: str | None) -> Binding | None:
+        if not sessionId: return None
+        return misc.find_first(self.bindings, lambda binding: binding.sessionId == sessionId)
+
+    def select_binding(self) -> Binding | None:
+        candidates = [binding for binding in self.bindings if binding.healthy]
+        if not candidates: candidates = [binding for binding in self.bindings if binding.isOpen]
+        if not candidates: return None
+
+        if self.balance == BALANCE_WEIGHTED:
+            total = 0
+            selected = candidates[0]
+            for binding in candidates:
+                binding.current_weight += binding.weight
+                total += binding.weight
+                if binding.current_weight > selected.current_weight: selected = binding
+            selected.current_weight -= total
+            return selected
+
+        return min(candidates, key=lambda binding: binding.active / binding.weight)
 
     async def on_client(self, connection: SocketWrapper, *, headers: dict | None = None):
         isOpen = await self.is_open()
-        if not isOpen:
+        if not isOpen and not self.is_resumable():
             connection.close()
             return
         
         ip = misc.get_ip(headers if headers else {}, [connection.ip])
         
-        if self.auth and (not ip or not ip in self.accepted):
+        if (self.auth or self.allowlist.restricted) and not self.allowlist.allows(ip):
             connection.close()
             return
 
-        identifier = self.registry.register(connection)
-        payload = misc.serialize({
-            'identifier': identifier,
-            'command': 'new_request'
-        }) + b';'
-
-        if not self.binding:
-            connection.close()
+        if self.max_streams and self.streams >= self.max_streams:
+            REQUEST_STATS['limited'] += 1
+            logger.debug(f'Stream limit {self.max_streams} reached on {self.host_type} {self.con}')
+            await self.__refuse(connection, '503 Service Unavailable', BUSY_PAGE)
             return
 
-        self.binding.write(payload)
-        await self.binding.flush()
-
-        await asyncio.sleep(REQUEST_TIMEOUT)
-        if self.registry.pop(identifier):
-            connection.close()
+        self.socket_options.apply(connection.writer.get_extra_info('socket'), f'{self.host_type} {self.con}')
+        identifier = self.registry.register(connection)
+        self.request_timeouts[identifier] = asyncio.get_running_loop().call_later(REQUEST_TIMEOUT, self.__expire_request, identifier)
+        await self.__send_new_request(identifier)
 
     async def on_message(self, data: bytes, addr: tuple[str | typing.Any, int], retries = 3):
         pool = self.get_pool()
@@ -158,6 +295,11 @@ class GenericHost:
                 await self.on_message(data, addr, retries=retries-1)
             return
         
+        # datagrams are dropped rather than queued once the client falls behind, the transport buffer would grow without limit
+        if pool.writer.transport.get_write_buffer_size() > UDP_POOL_MAX_BUFFER:
+            REQUEST_STATS['udp_dropped'] += 1
+            return
+
         host, port = addr
         command = misc.serialize({
             'type': 'new_message',
@@ -166,8 +308,7 @@ class GenericHost:
             'payload': data.hex()
         }) + b';'
 
-        pool.write(command)
-        await pool.flush()
+        pool.write_frame(command)
 
     def get_pool(self):
         count = len(self.pool)
@@ -175,71 +316,176 @@ class GenericHost:
         self.pool_index = index = (self.pool_index + 1) % count
         return self.pool[index]
 
-    async def __listen(self):
-        currentBinding = self.binding
-        if not currentBinding: return
+    async def __make_room(self, connection: SocketWrapper):
+        if len(self.bindings) < self.max_clients: return True
+
+        replaceable = misc.find_first(self.bindings, lambda binding: not binding.isOpen and binding.session_expiry is None)
+        if not replaceable:
+            replaceable = misc.find_first(self.bindings, lambda binding: binding.connection.ip == connection.ip)
+        if not replaceable: return False
+
+        await self.__remove_binding(replaceable)
+        return True
+
+    async def __remove_binding(self, binding: Binding):
+        binding.connection.close()
+        binding.session_expiry = None
+        binding.tasks.cancel()
+        try: self.bindings.remove(binding)
+        except Exception: pass
+
+    def __release(self, identifier: str):
+        binding = self.assigned.pop(identifier, None)
+        if binding: binding.active -= 1
+
+    def __drop_request(self, identifier: str):
+        timeout = self.request_timeouts.pop(identifier, None)
+        if timeout: timeout.cancel()
+
+        if identifier in self.request_ids:
+            self.request_ids.remove(identifier)
+
+        pending = self.registry.pop(identifier)
+        if pending:
+            self.__release(identifier)
+            pending.close()
+
+    def __expire_request(self, identifier: str):
+        REQUEST_STATS['timed_out'] += 1
+        self.__drop_request(identifier)
+
+    async def __reject_request(self, binding: Binding, identifier: str):
+        if self.assigned.get(identifier) is not binding: return
+
+        timeout = self.request_timeouts.pop(identifier, None)
+        if timeout: timeout.cancel()
+        self.__release(identifier)
+
+        pending = self.registry.pop(identifier)
+        if not pending: return
+
+        REQUEST_STATS['rejected'] += 1
+        logger.debug(f'Visitor rejected by the client on {self.host_type} {self.con}')
+        await self.__refuse(pending, '502 Bad Gateway', BAD_GATEWAY_PAGE, abort=True)
+
+    async def __refuse(self, connection: SocketWrapper, status: str, page: str, abort = False):
+        if self.host_type != 'http' or misc.is_tls_handshake(connection.buffer[:1]):
+            if abort: connection.abort()
+            else: connection.close()
+            return
+
+        try:
+            connection.write(misc.http_response(page, status).encode())
+            await connection.flush()
+        except Exception: pass
+        connection.close()
+
+    async def __send_new_request(self, identifier: str):
+        binding = self.select_binding()
+        if not binding:
+            self.request_ids.append(identifier)
+            return
+
+        self.__release(identifier)
+        self.assigned[identifier] = binding
+        binding.active += 1
+
+        payload = misc.serialize({
+            'type': self.host_type,
+            'resource': self.con,
+            'identifier': identifier,
+            'command': 'new_request'
+        }) + b';'
+
+        binding.connection.write_frame(payload)
+
+    async def __flush_pending_requests(self):
+        request_ids, self.request_ids = self.request_ids, []
+        for identifier in request_ids:
+            await self.__send_new_request(identifier)
+
+    async def __failover(self, binding: Binding):
+        orphans = [identifier for identifier, assigned in self.assigned.items() if assigned is binding]
+        for identifier in orphans:
+            await self.__send_new_request(identifier)
+
+    async def __expire_session(self, binding: Binding):
+        await asyncio.sleep(SESSION_GRACE)
+        binding.session_expiry = None
+        if binding.isOpen: return
+
+        logger.info(f'Session expired for {self.host_type} {self.con}')
+        await self.__remove_binding(binding)
+        if self.bindings: return
+
+        if self.host: await self.host.stop()
+
+        for connection in list(self.pool):
+            connection.close()
+
+        for identifier in list(self.request_ids):
+            self.__drop_request(identifier)
+
+    async def __listen(self, binding: Binding):
+        currentConnection = binding.connection
         while True:
-            buffer = await currentBinding.read_until(b';')
-            if buffer is None or not currentBinding.isOpen or len(buffer) == 0:
-                currentBinding.close()
-                if self.host: await self.host.stop()
+            buffer = await currentConnection.read_until(b';')
+            if buffer is None or not currentConnection.isOpen or len(buffer) == 0:
+                currentConnection.close()
+                if binding.connection is currentConnection and binding.session_expiry is None and binding in self.bindings:
+                    binding.session_expiry = binding.tasks.spawn(self.__expire_session(binding))
+                    await self.__failover(binding)
                 break
             else:
-                self.lastPong = datetime.datetime.now()
+                binding.lastPong = datetime.datetime.now()
 
-            try: await self.__process_listen_command(currentBinding, buffer)
+            try: await self.__process_listen_command(binding, buffer)
             except Exception: pass
 
-    async def __process_listen_command(self, binding: SocketWrapper, buffer: bytes):
+    async def __process_listen_command(self, binding: Binding, buffer: bytes):
         in_payload = misc.deserialize(buffer)
+        if in_payload.get('type') == 'pong':
+            if binding.lastPing: binding.rtt = misc.seconds_since(binding.lastPing, binding.lastPong)
+            return
+
         command = in_payload['command']
-        if command == 'add_pool':
-            identifier = self.pool_registry.register(binding)
+        if command == 'reject':
+            identifier = in_payload.get('identifier')
+            if isinstance(identifier, str): await self.__reject_request(binding, identifier)
+        elif command == 'add_pool':
+            identifier = self.pool_registry.register(binding.connection)
             payload = misc.serialize({
                 'type': self.host_type,
                 'identifier': identifier,
                 'command': 'new_pool',
                 'target': self.con
             }) + b';'
-            binding.write(payload)
-            await binding.flush()
+            binding.connection.write_frame(payload)
 
-    async def __ping(self):
-        currentBinding = self.binding
-        if not currentBinding: return
-        self.lastPong = datetime.datetime.now()
+    async def __ping(self, binding: Binding):
+        currentConnection = binding.connection
+        binding.lastPong = datetime.datetime.now()
         while True:
-            if not currentBinding.isOpen:
-                currentBinding.close()
+            if not currentConnection.isOpen:
+                currentConnection.close()
                 logger.info('Disconnecting: connection closed')
                 break
 
-            deltaSec = misc.seconds_since(self.lastPong)
+            deltaSec = misc.seconds_since(binding.lastPong)
             if deltaSec > PING_TIMEOUT:
-                currentBinding.close()
+                currentConnection.close()
                 logger.warning(f'Disconnecting: Timeout ({deltaSec}s)')
                 break
             try:
-                currentBinding.write(misc.serialize({'type': 'ping'}) + b';')
-                await currentBinding.flush()
+                binding.lastPing = datetime.datetime.now()
+                currentConnection.write_frame(misc.serialize({'type': 'ping'}) + b';', urgent=True)
+                await currentConnection.flush()
             except Exception:
                 logger.error('Disconnecting: failed to send ping')
-                currentBinding.close()
+                currentConnection.close()
                 break
             await asyncio.sleep(PING_INTERVAL)
 
-    async def __write_worker(self, reader: SocketWrapper, writer: SocketWrapper):
-        while True:
-            try:
-                data = await reader.read_size(misc.READ_BUFFER_SIZE)
-                if data == None or data == b'' or not reader.isOpen or not writer.isOpen:
-                    break
-                writer.write(data)
-                await writer.flush()
-            except Exception: break
-        reader.close()
-        writer.close()
-    
     async def __pool_reader(self, connection: SocketWrapper):
         while True:
             try:
@@ -1,21 +1,21 @@
 import logging
-from typing import List
 from helpers import SocketWrapper, misc
 from genericHost import GenericHost
+from resourceStore import ResourceIndex
 from handlers import ProtocolHandler
 
 logger = logging.getLogger(__name__)
 
 
 class HttpProtocolHandler(ProtocolHandler):
-    def __init__(self, resources: List[GenericHost]):
+    def __init__(self, resources: ResourceIndex):
         self.resources = resources
     
     def find_resource(self, resource: str) -> GenericHost | None:
         if not resource:
             return None
         
-        return misc.find_first(self.resources, lambda x: x.con == resource)
+        return self.resources.find(resource)
     
     async def authenticate(self, data: dict, connection: SocketWrapper) -> None:
         resource = data['resource']
@@ -37,12 +37,12 @@ class HttpProtocolHandler(ProtocolHandler):
         
         await http_host.new_client(data, connection)
     
-    async def auth_request(self, ip: str, resource_item: str, resource_code: str) -> bool:
+    async def auth_request(self, ip: str, resource_item: str, resource_code: str) -> bool | None:
         if not resource_item:
-            return False
+            return None
         
-        http = misc.find_first(self.resources, lambda x: x.con == resource_item)
+        http = self.resources.find(resource_item)
         if not isinstance(http, GenericHost):
-            return False
+            return None
         
         return await http.auth_request(ip, resource_code)
@@ -17,5 +17,5 @@ class ProtocolHandler(ABC):
         pass
     
     @abstractmethod
-    async def auth_request(self, ip: str, resource_item: str, resource_code: str) -> bool:
+    async def auth_request(self, ip: str, resource_item: str, resource_code: str) -> bool | None:
         pass
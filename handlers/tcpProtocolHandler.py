@@ -1,14 +1,14 @@
 import logging
-from typing import List
 from helpers import SocketWrapper, misc
 from genericHost import GenericHost
+from resourceStore import ResourceIndex
 from handlers import ProtocolHandler
 
 logger = logging.getLogger(__name__)
 
 
 class TcpProtocolHandler(ProtocolHandler):
-    def __init__(self, resources: List[GenericHost]):
+    def __init__(self, resources: ResourceIndex):
         self.resources = resources
     
     def find_resource(self, resource: str) -> GenericHost | None:
@@ -16,7 +16,7 @@ class TcpProtocolHandler(ProtocolHandler):
         if not port:
             return None
         
-        return misc.find_first(self.resources, lambda x: x.con == port)
+        return self.resources.find(port)
     
     async def authenticate(self, data: dict, connection: SocketWrapper) -> None:
         resource = data['resource']
@@ -38,13 +38,13 @@ class TcpProtocolHandler(ProtocolHandler):
         
         await tcp_host.new_client(data, connection)
     
-    async def auth_request(self, ip: str, resource_item: str, resource_code: str) -> bool:
+    async def auth_request(self, ip: str, resource_item: str, resource_code: str) -> bool | None:
         port = misc.to_int(resource_item, None)
         if not port:
-            return False
+            return None
         
-        tcp = misc.find_first(self.resources, lambda x: x.con == port)
+        tcp = self.resources.find(port)
         if not isinstance(tcp, GenericHost):
-            return False
+            return None
         
         return await tcp.auth_request(ip, resource_code)
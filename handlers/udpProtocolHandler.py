@@ -1,13 +1,13 @@
 import logging
-from typing import List
 from helpers import SocketWrapper, misc
 from genericHost import GenericHost
+from resourceStore import ResourceIndex
 from handlers import ProtocolHandler
 
 logger = logging.getLogger(__name__)
 
 class UdpProtocolHandler(ProtocolHandler):
-    def __init__(self, resources: List[GenericHost]):
+    def __init__(self, resources: ResourceIndex):
         self.resources = resources
     
     def find_resource(self, resource: str) -> GenericHost | None:
@@ -15,7 +15,7 @@ class UdpProtocolHandler(ProtocolHandler):
         if not port:
             return None
         
-        return misc.find_first(self.resources, lambda x: x.con == port)
+        return self.resources.find(port)
     
     async def authenticate(self, data: dict, connection: SocketWrapper) -> None:
         resource = data['resource']
@@ -37,13 +37,13 @@ class UdpProtocolHandler(ProtocolHandler):
         
         await udp_host.add_pool(data, connection)
     
-    async def auth_request(self, ip: str, resource_item: str, resource_code: str) -> bool:
+    async def auth_request(self, ip: str, resource_item: str, resource_code: str) -> bool | None:
         port = misc.to_int(resource_item, None)
         if not port:
-            return False
+            return None
         
-        udp = misc.find_first(self.resources, lambda x: x.con == port)
+        udp = self.resources.find(port)
         if not isinstance(udp, GenericHost):
-            return False
+            return None
         
         return await udp.auth_request(ip, resource_code)
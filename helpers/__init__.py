@@ -5,6 +5,7 @@ from helpers.misc import (
     sha256_match,
     new_uuid,
     validate_port,
+    parse_port_range,
     to_int,
     find_first,
     seconds_since,
@@ -14,15 +15,28 @@ from helpers.misc import (
     http_response,
     get_http_headers,
     http_identification,
+    tls_identification,
     get_ip,
 )
 
 from helpers.csvReader import CSVReader
+from helpers import secretHash
+from helpers import eventLoop
+from helpers import taskScope
+from helpers import resolver
+from helpers import fdBudget
 from helpers.socketWrapper import SocketWrapper
 from helpers.socketClient import SocketClient
+from helpers.connectionPool import ConnectionPool
 from helpers.socketHost import SocketHost
 from helpers.socketHost import create_host
 from helpers.socketRegistry import SocketRegistry
+from helpers.relay import relay
+from helpers.taskScope import TaskScope
+from helpers.ipAllowlist import IPAllowlist
+from helpers.controlChannel import ControlChannel
+from helpers.tlsServer import TLSServerContext
+from helpers.fileWatcher import FileWatcher
 
 __all__ = [
     'serialize',
@@ -31,6 +45,7 @@ __all__ = [
     'sha256_match',
     'new_uuid',
     'validate_port',
+    'parse_port_range',
     'to_int',
     'find_first',
     'seconds_since',
@@ -40,11 +55,24 @@ __all__ = [
     'http_response',
     'get_http_headers',
     'http_identification',
+    'tls_identification',
     'get_ip',
     'create_host',
     'CSVReader',
+    'secretHash',
+    'eventLoop',
+    'taskScope',
+    'resolver',
+    'fdBudget',
     'SocketWrapper',
     'SocketClient',
+    'ConnectionPool',
     'SocketHost',
     'SocketRegistry',
+    'relay',
+    'TaskScope',
+    'IPAllowlist',
+    'ControlChannel',
+    'TLSServerContext',
+    'FileWatcher',
 ]
@@ -0,0 +1,123 @@
+import asyncio, time, logging
+from collections import deque
+from helpers import misc
+from helpers.socketClient import SocketClient
+from helpers.socketOptions import SocketOptions
+
+logger = logging.getLogger(__name__)
+
+POOL_IDLE_TIMEOUT = 30
+POOL_RETRY_DELAY = 1
+CONNECT_TIMEOUT = 10
+
+class ConnectionPool:
+    def __init__(self, host: str, port: int, ssl_client=False, ssl_disable_verify=False, size: int = 0, max_connections: int = 0, socket_options: SocketOptions | None = None) -> None:
+        self.host = host
+        self.port = port
+        self.ssl_client = ssl_client
+        self.ssl_disable_verify = ssl_disable_verify
+        self.socket_options = socket_options
+        self.size = max(0, size)
+        self.max_connections = max(0, max_connections)
+        self.idle: deque[tuple[SocketClient, float]] = deque()
+        self.opening = 0
+        self.active = 0
+        self.running = False
+        self.stats = {'warm': 0, 'cold': 0, 'discarded': 0}
+        self.__limit = asyncio.Semaphore(self.max_connections) if self.max_connections > 0 else None
+
+    def start(self):
+        if self.running or self.size == 0: return
+        self.running = True
+        self.__refill()
+        misc.queue_task(self.__expire_idle())
+
+    async def reserve(self):
+        '''Wait for a free slot without connecting, the slot is then taken by acquire(reserved=True)'''
+        if self.__limit: await self.__limit.acquire()
+
+    async def acquire(self, reserved=False) -> SocketClient:
+        '''Wait for a free slot (unless reserved) and return a connected client, release() must be called once it's done. Raises TimeoutError if the connect takes longer than CONNECT_TIMEOUT'''
+        if self.__limit and not reserved: await self.__limit.acquire()
+        try:
+            client = self.__take_idle()
+            if client is None:
+                client = self.__new_client()
+                try: await asyncio.wait_for(client.start(), CONNECT_TIMEOUT)
+                except BaseException:
+                    client.stop()
+                    raise
+                self.stats['cold'] += 1
+            else:
+                self.stats['warm'] += 1
+        except BaseException:
+            if self.__limit: self.__limit.release()
+            raise
+        finally:
+            self.__refill()
+
+        self.active += 1
+        return client
+
+    def release(self, client: SocketClient):
+        client.stop()
+        self.active -= 1
+        if self.__limit: self.__limit.release()
+
+    def close(self):
+        self.running = False
+        while self.idle:
+            client, _ = self.idle.popleft()
+            client.stop()
+
+    def __new_client(self):
+        return SocketClient(self.host, self.port, ssl_client=self.ssl_client, ssl_disable_verify=self.ssl_disable_verify, socket_options=self.socket_options)
+
+    def __take_idle(self) -> SocketClient | None:
+        while self.idle:
+            client, created = self.idle.popleft()
+            if self.__usable(client, created): return client
+            self.stats['discarded'] += 1
+            client.stop()
+        return None
+
+    def __usable(self, client: SocketClient, created: float):
+        connection = client.connection
+        if not connection or not connection.isOpen: return False
+        if connection.writer.transport.is_closing() or connection.reader.at_eof(): return False
+        return time.monotonic() - created < POOL_IDLE_TIMEOUT
+
+    def __refill(self):
+        if not self.running: return
+        for _ in range(self.size - len(self.idle) - self.opening):
+            self.opening += 1
+            misc.queue_task(self.__open())
+
+    async def __open(self):
+        client = self.__new_client()
+        try:
+            await asyncio.wait_for(client.start(), CONNECT_TIMEOUT)
+        except Exception as e:
+            client.stop()
+            logger.debug(f'Failed to open pooled connection to {self.host}:{self.port}: {str(e)}')
+            await asyncio.sleep(POOL_RETRY_DELAY)
+            return
+        finally:
+            self.opening -= 1
+
+        if not self.running:
+            client.stop()
+            return
+        self.idle.append((client, time.monotonic()))
+
+    async def __expire_idle(self):
+        while self.running:
+            await asyncio.sleep(POOL_IDLE_TIMEOUT / 2)
+            kept: deque[tuple[SocketClient, float]] = deque()
+            for client, created in self.idle:
+                if self.__usable(client, created): kept.append((client, created))
+                else:
+                    self.stats['discarded'] += 1
+                    client.stop()
+            self.idle = kept
+            self.__refill()
@@ -0,0 +1,112 @@
+import asyncio, typing, datetime, logging
+from helpers import misc, SocketWrapper
+
+logger = logging.getLogger(__name__)
+
+ChannelKey = tuple[str, str]
+
+class ChannelConnection:
+    def __init__(self, channel: 'ControlChannel', key: ChannelKey) -> None:
+        self.channel = channel
+        self.key = key
+        self.frames: asyncio.Queue[bytes | None] = asyncio.Queue()
+        self.isOpen = True
+        self.ip = channel.connection.ip
+        self.port = channel.connection.port
+
+    async def read_until(self, data: bytes):
+        if not self.isOpen: return None
+        return await self.frames.get()
+
+    def write(self, data: bytes):
+        if not self.isOpen: return
+        self.channel.connection.write(data)
+
+    def write_frame(self, data: bytes, urgent = False):
+        if not self.isOpen: return
+        self.channel.connection.write_frame(data, urgent)
+
+    async def flush(self):
+        await self.channel.connection.flush()
+
+    def close(self):
+        if not self.isOpen: return
+        self.isOpen = False
+        self.frames.put_nowait(None)
+        self.channel.detach(self)
+
+class ControlChannel:
+    def __init__(self, connection: SocketWrapper, ping_interval: float = 15, ping_timeout: float = 60) -> None:
+        self.connection = connection
+        self.connections: dict[ChannelKey, ChannelConnection] = {}
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.lastPong = datetime.datetime.now()
+        self.lastPing: datetime.datetime | None = None
+        self.rtt: float | None = None
+
+    @staticmethod
+    def key(resource_type: typing.Any, resource: typing.Any) -> ChannelKey:
+        return (str(resource_type), str(resource))
+
+    def open(self, resource_type: typing.Any, resource: typing.Any) -> ChannelConnection:
+        key = self.key(resource_type, resource)
+        existing = self.connections.get(key, None)
+        if existing: existing.close()
+
+        connection = ChannelConnection(self, key)
+        self.connections[key] = connection
+        return connection
+
+    def detach(self, connection: ChannelConnection):
+        if self.connections.get(connection.key, None) is connection:
+            self.connections.pop(connection.key)
+        if len(self.connections) == 0:
+            self.connection.close()
+
+    async def listen(self):
+        '''Route frames to the resource connections, one ping loop covers every resource of the channel'''
+        ping = asyncio.create_task(self.__ping())
+        try: await self.__listen()
+        finally: ping.cancel()
+
+    async def __listen(self):
+        while True:
+            frame = await self.connection.read_until(b';')
+            if not frame or not self.connection.isOpen:
+                break
+
+            try: payload = misc.deserialize(frame)
+            except Exception: continue
+
+            if isinstance(payload, dict) and payload.get('type') == 'pong' and 'resource' not in payload:
+                self.lastPong = datetime.datetime.now()
+                if self.lastPing: self.rtt = misc.seconds_since(self.lastPing, self.lastPong)
+                continue
+
+            target = None
+            if isinstance(payload, dict) and 'resource' in payload:
+                target = self.connections.get(self.key(payload.get('type'), payload.get('resource')), None)
+
+            if target:
+                target.frames.put_nowait(frame)
+                continue
+
+            for connection in list(self.connections.values()):
+                connection.frames.put_nowait(frame)
+
+        self.connection.close()
+        for connection in list(self.connections.values()):
+            connection.close()
+
+    async def __ping(self):
+        while self.connection.isOpen:
+            delta = misc.seconds_since(self.lastPong)
+            if delta > self.ping_timeout:
+                logger.warning(f'Disconnecting control channel: Timeout ({delta}s)')
+                self.connection.close()
+                break
+
+            self.lastPing = datetime.datetime.now()
+            self.connection.write_frame(misc.serialize({'type': 'ping'}) + b';', urgent=True)
+            await asyncio.sleep(self.ping_interval)
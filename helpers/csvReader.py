@@ -9,8 +9,10 @@ class CSVReader:
     self.headers: list[str] = []
     self.rows: list[list[str]] = []
     self.data: list[dict[str, str]] = []
+    self.error: str | None = None
 
     if not file.exists():
+      self.error = f'File {file} not found'
       return
 
     rawData: list[list[str]] = []
@@ -20,6 +22,7 @@ class CSVReader:
         rawData = [i for i in reader]
     except Exception as e:
       logger.error(f'Failed to read CSV file {file}: {str(e)}')
+      self.error = str(e)
       return
 
     if len(rawData) == 0:
@@ -0,0 +1,60 @@
+import asyncio, typing, logging, os, time
+
+logger = logging.getLogger(__name__)
+
+EVENT_LOOP_AUTO = 'auto'
+EVENT_LOOP_ASYNCIO = 'asyncio'
+EVENT_LOOP_UVLOOP = 'uvloop'
+EVENT_LOOPS = [EVENT_LOOP_AUTO, EVENT_LOOP_ASYNCIO, EVENT_LOOP_UVLOOP]
+
+LOOP_LAG_INTERVAL = 1
+LOOP_LAG_WARNING = 0.1
+LOOP_REPORT_INTERVAL = 60
+
+LOOP_STATS: dict[str, typing.Any] = {'loop': EVENT_LOOP_ASYNCIO, 'lag': 0.0, 'max_lag': 0.0}
+
+def loop_factory(name: str | None) -> tuple[str, typing.Callable[[], asyncio.AbstractEventLoop] | None]:
+    name = (name or os.getenv('EVENT_LOOP', None) or EVENT_LOOP_AUTO).lower()
+    if name not in EVENT_LOOPS:
+        logger.warning(f'Unknown event loop {name} (accepted: {", ".join(EVENT_LOOPS)}), using {EVENT_LOOP_AUTO}')
+        name = EVENT_LOOP_AUTO
+
+    if name in [EVENT_LOOP_AUTO, EVENT_LOOP_UVLOOP]:
+        try:
+            import uvloop
+            return EVENT_LOOP_UVLOOP, uvloop.new_event_loop
+        except ImportError:
+            if name == EVENT_LOOP_UVLOOP: raise ValueError('uvloop is not installed (requested with --eventLoop uvloop or EVENT_LOOP=uvloop)')
+
+    return EVENT_LOOP_ASYNCIO, None
+
+def run(main: typing.Coroutine, name: str | None = None):
+    try: loop_name, factory = loop_factory(name)
+    except ValueError as e:
+        main.close()
+        logger.error(str(e))
+        raise SystemExit(1)
+    LOOP_STATS['loop'] = loop_name
+
+    with asyncio.Runner(loop_factory=factory) as runner:
+        runner.run(main)
+
+async def monitor_lag(interval: float = LOOP_LAG_INTERVAL):
+    reported = False
+    last_report = time.monotonic()
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - started - interval)
+
+        LOOP_STATS['lag'] = lag
+        if lag > LOOP_STATS['max_lag']: LOOP_STATS['max_lag'] = lag
+
+        if not reported:
+            logger.info(f'Event loop {LOOP_STATS["loop"]} running (lag {lag * 1000:.1f}ms)')
+            reported = True
+        elif lag > LOOP_LAG_WARNING: logger.warning(f'Event loop lag {lag * 1000:.0f}ms')
+
+        if time.monotonic() - last_report >= LOOP_REPORT_INTERVAL:
+            last_report = time.monotonic()
+            logger.debug(f'Event loop {LOOP_STATS["loop"]} lag {lag * 1000:.1f}ms (max {LOOP_STATS["max_lag"] * 1000:.1f}ms)')
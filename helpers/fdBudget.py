@@ -0,0 +1,56 @@
+import asyncio, typing, logging, os
+
+try: import resource
+except ImportError: resource = None
+
+logger = logging.getLogger(__name__)
+
+FD_SAMPLE_INTERVAL = 1
+FD_SHED_RATIO = 0.9
+FD_MAX_LIMIT = 1024 * 1024
+
+FD_STATS: dict[str, typing.Any] = {'open': 0, 'limit': 0, 'shed': 0, 'sampled': False}
+
+def raise_limit() -> int:
+    '''Raise the soft RLIMIT_NOFILE up to the hard limit, returns the limit in use (0 when unknown)'''
+    if resource is None: return 0
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = FD_MAX_LIMIT if hard == resource.RLIM_INFINITY else hard
+    if soft != resource.RLIM_INFINITY and soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError) as e:
+            logger.warning(f'Failed to raise the open file limit from {soft} to {target}: {str(e)}')
+
+    FD_STATS['limit'] = FD_MAX_LIMIT if soft == resource.RLIM_INFINITY else soft
+    logger.info(f'Open file limit {FD_STATS["limit"]} (new connections are shed above {int(FD_STATS["limit"] * FD_SHED_RATIO)})')
+    return FD_STATS['limit']
+
+def count_open() -> int | None:
+    '''Blocking directory scan, monitor runs it in the default executor'''
+    try: return len(os.listdir('/proc/self/fd'))
+    except OSError: return None
+
+def allows() -> bool:
+    '''False when the process is close to the open file limit and new connections should be shed'''
+    if not FD_STATS['sampled'] or not FD_STATS['limit']: return True
+    return FD_STATS['open'] < FD_STATS['limit'] * FD_SHED_RATIO
+
+def shed():
+    FD_STATS['shed'] += 1
+
+async def monitor(interval: float = FD_SAMPLE_INTERVAL):
+    shedding = False
+    while True:
+        count = await asyncio.get_running_loop().run_in_executor(None, count_open)
+        if count is None: return
+
+        FD_STATS['open'] = count
+        FD_STATS['sampled'] = True
+        if shedding == allows():
+            shedding = not shedding
+            if shedding: logger.warning(f'{count} of {FD_STATS["limit"]} file descriptors open, shedding new connections')
+            else: logger.info(f'{count} of {FD_STATS["limit"]} file descriptors open, accepting new connections again')
+        await asyncio.sleep(interval)
@@ -0,0 +1,37 @@
+import asyncio, typing, logging, time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+FILE_WATCH_INTERVAL = 5
+
+class FileWatcher:
+    def __init__(self, file: Path, on_change: typing.Callable[[Path], typing.Coroutine], interval: float = FILE_WATCH_INTERVAL) -> None:
+        self.file = file
+        self.on_change = on_change
+        self.interval = interval
+        self.mtime = self.get_mtime()
+        self.reloads = 0
+        self.errors = 0
+        self.last_duration: float | None = None
+
+    def get_mtime(self) -> float | None:
+        try: return self.file.stat().st_mtime
+        except OSError: return None
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            mtime = self.get_mtime()
+            if mtime is None or mtime == self.mtime: continue
+            self.mtime = mtime
+
+            started = time.perf_counter()
+            try:
+                await self.on_change(self.file)
+                self.reloads += 1
+                self.last_duration = time.perf_counter() - started
+                logger.info(f'Reloaded {self.file.name} in {self.last_duration * 1000:.1f}ms ({self.reloads} reloads, {self.errors} failed)')
+            except Exception as e:
+                self.errors += 1
+                logger.error(f'Failed to reload {self.file.name}, keeping previous configuration ({self.errors} failed of {self.reloads + self.errors}): {str(e)}')
@@ -0,0 +1,95 @@
+import ipaddress, time
+from collections import OrderedDict
+
+ALLOWLIST_TTL = 24 * 60 * 60
+ALLOWLIST_SIZE = 10000
+
+IPAddress = ipaddress.IPv4Address | ipaddress.IPv6Address
+
+def parse_ip(ip: str | None) -> IPAddress | None:
+    if not ip: return None
+    try: address = ipaddress.ip_address(ip.strip().strip('[]'))
+    except ValueError: return None
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped: return address.ipv4_mapped
+    return address
+
+class PrefixNode:
+    __slots__ = ('children', 'terminal')
+
+    def __init__(self) -> None:
+        self.children: list[PrefixNode | None] = [None, None]
+        self.terminal = False
+
+class PrefixTree:
+    def __init__(self) -> None:
+        self.roots = {4: PrefixNode(), 6: PrefixNode()}
+        self.size = 0
+
+    def add(self, network: ipaddress.IPv4Network | ipaddress.IPv6Network):
+        node = self.roots[network.version]
+        address = int(network.network_address)
+        for i in range(network.prefixlen):
+            bit = (address >> (network.max_prefixlen - 1 - i)) & 1
+            child = node.children[bit]
+            if child is None:
+                child = node.children[bit] = PrefixNode()
+            node = child
+
+        if not node.terminal: self.size += 1
+        node.terminal = True
+
+    def match(self, address: IPAddress) -> bool:
+        node = self.roots[address.version]
+        value = int(address)
+        for i in range(address.max_prefixlen):
+            if node.terminal: return True
+            child = node.children[(value >> (address.max_prefixlen - 1 - i)) & 1]
+            if child is None: return False
+            node = child
+        return node.terminal
+
+class IPAllowlist:
+    def __init__(self, ttl: float = ALLOWLIST_TTL, max_size: int = ALLOWLIST_SIZE) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries: OrderedDict[IPAddress, float] = OrderedDict()
+        self.prefixes = PrefixTree()
+
+    def __len__(self): return len(self.entries)
+
+    @property
+    def restricted(self): return self.prefixes.size > 0
+
+    def set_prefixes(self, prefixes: list[str]):
+        tree = PrefixTree()
+        for prefix in prefixes:
+            prefix = prefix.strip()
+            if not prefix: continue
+            tree.add(ipaddress.ip_network(prefix, strict=False))
+        self.prefixes = tree
+
+    def add(self, ip: str | None) -> bool:
+        address = parse_ip(ip)
+        if address is None: return False
+
+        self.entries[address] = time.monotonic() + self.ttl
+        self.entries.move_to_end(address)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return True
+
+    def allows(self, ip: str | None) -> bool:
+        address = parse_ip(ip)
+        if address is None: return False
+
+        expiry = self.entries.get(address, None)
+        if expiry is not None:
+            if expiry > time.monotonic():
+                self.entries.move_to_end(address)
+                return True
+            self.entries.pop(address, None)
+
+        return self.prefixes.match(address)
+
+    def clear(self):
+        self.entries.clear()
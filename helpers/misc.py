@@ -1,7 +1,8 @@
-import asyncio, typing, hashlib, uuid, time, json, base64, datetime, logging
+import asyncio, typing, hashlib, hmac, uuid, time, json, base64, datetime, logging
 from pathlib import Path
 from helpers.socketWrapper import SocketWrapper
 from helpers.csvReader import CSVReader
+from helpers import taskScope
 
 logger = logging.getLogger(__name__)
 
@@ -10,28 +11,33 @@ ROOT = Path(__file__).parent.parent
 MIN_PORT_NUMBER = 1
 MAX_PORT_NUMBER = 65535
 READ_BUFFER_SIZE = 5125
-
-__task_stack: dict[str, asyncio.Task] = {}
+TLS_HANDSHAKE_RECORD = 0x16
+TLS_CLIENT_HELLO = 0x01
+TLS_SNI_EXTENSION = 0x0000
+TLS_MAX_RECORD_SIZE = 16384 + 2048
 
 def queue_task(coro: typing.Coroutine) -> None:
-    taskId = new_uuid()
-    def on_done(doneTask: asyncio.Task) -> None:
-        try: __task_stack.pop(taskId)
-        except Exception: pass
-
-        try: doneTask.result()
-        except Exception as e:
-            logger.error(f"Unhandled exception in background task: {str(e)}")
-
-    task = asyncio.create_task(coro)
-    __task_stack[taskId] = task
-    task.add_done_callback(on_done)
+    taskScope.root.spawn(coro)
 
 def validate_port(port):
     if not isinstance(port, int): raise ValueError(f'Port has to be an int between {MIN_PORT_NUMBER} and {MAX_PORT_NUMBER}')
     if port > MAX_PORT_NUMBER: raise ValueError(f'Port have to be an int of max {MAX_PORT_NUMBER}')
     if port < MIN_PORT_NUMBER: raise ValueError(f'Port have to be an int of min {MIN_PORT_NUMBER}')
 
+def parse_port_range(data: str) -> tuple[int, int] | None:
+    if not '-' in data: return None
+    start, end = to_int(data.split('-', 1)[0], None), to_int(data.split('-', 1)[1], None)
+    if start is None or end is None: raise ValueError(f'Invalid port range {data}')
+    validate_port(start)
+    validate_port(end)
+    if start > end: raise ValueError(f'Invalid port range {data}, start is greater than end')
+    return start, end
+
+def log_level(name: str | None) -> int:
+    '''Logging level for --logLevel / LOG_LEVEL (debug/info/warning/error), INFO when unset or unknown'''
+    level = logging.getLevelName((name or 'INFO').upper())
+    return level if isinstance(level, int) else logging.INFO
+
 def load_argv(sys_argv: list[str]) -> dict[str, str]:
     i = 0
     c = len(sys_argv) - 1
@@ -66,7 +72,7 @@ def sha256(secret: str, salt: str) -> str:
     return hashlib.sha256(f'{secret}{salt}'.encode('utf-8')).hexdigest()
 
 def sha256_match(hexdigest: str, secret: str, salt: str) -> bool:
-    return hexdigest == sha256(secret, salt)
+    return hmac.compare_digest(hexdigest.encode('utf-8'), sha256(secret, salt).encode('utf-8'))
 
 def new_uuid() -> str:
     return f'{uuid.uuid4().hex}.{time.time_ns()}'
@@ -82,9 +88,9 @@ def serialize(object: typing.Any) -> bytes:
 def deserialize(encoded: bytes) -> typing.Any:
     return json.loads(base64.b64decode(encoded).decode())
 
-def http_response(msg: str) -> str:
+def http_response(msg: str, status: str = '200 OK') -> str:
     utctime = datetime.datetime.now(datetime.timezone.utc).strftime('%a, %d %b %Y %H:%M:%S UTC')
-    return f'HTTP/1.1 200 OK\r\nServer: Yazaar-DTL-server\r\nDate: {utctime}\r\nContent-Type: text/html; charset=utf-8\r\nContent-Length: {len(msg)}\r\nConnection: close\r\n\r\n{msg}'
+    return f'HTTP/1.1 {status}\r\nServer: Yazaar-DTL-server\r\nDate: {utctime}\r\nContent-Type: text/html; charset=utf-8\r\nContent-Length: {len(msg)}\r\nConnection: close\r\n\r\n{msg}'
 
 def get_http_headers(data_bytes: bytes) -> dict[str, str]:
     headers: dict[str, str] = {}
@@ -105,7 +111,8 @@ def get_http_headers(data_bytes: bytes) -> dict[str, str]:
 async def http_identification(connection: SocketWrapper) -> dict[str, str]:
     buffer = b''
 
-    raw_headers, match = await connection.readuntil_any([b'\r\n\r\n', b'\n\n'])
+    try: raw_headers, match = await connection.readuntil_any([b'\r\n\r\n', b'\n\n'])
+    except (ConnectionError, BufferError): return {}
     buffer += raw_headers + match
 
     headers = get_http_headers(raw_headers)
@@ -113,8 +120,51 @@ async def http_identification(connection: SocketWrapper) -> dict[str, str]:
     connection.push_back(buffer)
     return headers
 
+def is_tls_handshake(data: bytes) -> bool:
+    return len(data) > 0 and data[0] == TLS_HANDSHAKE_RECORD
+
+def parse_tls_sni(record: bytes) -> str | None:
+    try:
+        if record[0] != TLS_HANDSHAKE_RECORD or record[5] != TLS_CLIENT_HELLO: return None
+        index = 9 + 2 + 32
+        index += 1 + record[index]
+        index += 2 + int.from_bytes(record[index:index + 2], 'big')
+        index += 1 + record[index]
+
+        extensions_end = index + 2 + int.from_bytes(record[index:index + 2], 'big')
+        index += 2
+        while index + 4 <= extensions_end:
+            extension_type = int.from_bytes(record[index:index + 2], 'big')
+            extension_size = int.from_bytes(record[index + 2:index + 4], 'big')
+            index += 4
+            if extension_type == TLS_SNI_EXTENSION:
+                name_type = record[index + 2]
+                name_size = int.from_bytes(record[index + 3:index + 5], 'big')
+                if name_type != 0: return None
+                return record[index + 5:index + 5 + name_size].decode('ascii').lower()
+            index += extension_size
+    except Exception:
+        pass
+    return None
+
+async def tls_identification(connection: SocketWrapper) -> str | None:
+    header = await connection.peek(5)
+    if len(header) < 5 or not is_tls_handshake(header): return None
+
+    record_size = 5 + int.from_bytes(header[3:5], 'big')
+    if record_size > TLS_MAX_RECORD_SIZE: return None
+
+    record = await connection.peek(record_size)
+    return parse_tls_sni(record)
+
 VALID_IP_HEADERS = CSVReader(ROOT / 'http_ip_headers.csv')
 
+async def reload_ip_headers(file: Path) -> None:
+    global VALID_IP_HEADERS
+    headers = CSVReader(file)
+    if headers.error: raise Exception(headers.error)
+    VALID_IP_HEADERS = headers
+
 def get_ip(headers: dict, fallbacks: list[str | None]) -> str | None:
     for header in VALID_IP_HEADERS.data:
         header_name = header.get('name', None)
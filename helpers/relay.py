@@ -0,0 +1,155 @@
+import asyncio
+from helpers import SocketWrapper
+
+RELAY_BUFFER_SIZE = 64 * 1024
+
+RELAY_STATS = {'idle_closed': 0}
+
+class RelayProtocol(asyncio.BufferedProtocol):
+    def __init__(self, relay: 'Relay') -> None:
+        self.relay = relay
+        self.transport: asyncio.Transport | None = None
+        self.peer: RelayProtocol | None = None
+        self.buffer = memoryview(bytearray(RELAY_BUFFER_SIZE))
+        self.bytes = 0
+        self.eof = False
+        self.closed = False
+
+    def get_buffer(self, sizehint: int):
+        return self.buffer
+
+    def buffer_updated(self, nbytes: int):
+        # copied on purpose: transport.write keeps a reference to whatever it could not send right away, and self.buffer is refilled by the next read
+        self.forward(bytes(self.buffer[:nbytes]))
+
+    def forward(self, data: bytes):
+        if not data or not self.peer or not self.peer.transport or self.peer.transport.is_closing(): return
+        self.bytes += len(data)
+        self.relay.active = True
+        self.peer.transport.write(data)
+
+    def eof_received(self):
+        self.eof = True
+        if self.peer and self.peer.transport and not self.peer.transport.is_closing() and self.peer.transport.can_write_eof():
+            self.peer.transport.write_eof()
+            if not self.peer.eof: return True
+        self.relay.close()
+        return False
+
+    def pause_writing(self):
+        if self.peer and self.peer.transport: self.peer.transport.pause_reading()
+
+    def resume_writing(self):
+        if self.peer and self.peer.transport: self.peer.transport.resume_reading()
+
+    def connection_lost(self, exc: Exception | None):
+        self.closed = True
+        self.relay.close()
+        self.relay.on_lost()
+
+class Relay:
+    def __init__(self, a: SocketWrapper, b: SocketWrapper, idle_timeout: float | None = None) -> None:
+        self.wrappers = (a, b)
+        self.a = RelayProtocol(self)
+        self.b = RelayProtocol(self)
+        self.a.peer, self.b.peer = self.b, self.a
+        self.done: asyncio.Future[tuple[int, int]] = asyncio.get_running_loop().create_future()
+        self.idle_timeout = idle_timeout
+        self.idle_handle: asyncio.TimerHandle | None = None
+        self.active = False
+
+    def check_idle(self):
+        if self.done.done() or not self.idle_timeout: return
+        if not self.active:
+            RELAY_STATS['idle_closed'] += 1
+            self.close()
+            return
+        self.active = False
+        self.idle_handle = asyncio.get_running_loop().call_later(self.idle_timeout, self.check_idle)
+
+    def close(self):
+        for protocol in (self.a, self.b):
+            if protocol.transport and not protocol.transport.is_closing(): protocol.transport.close()
+
+    def on_lost(self):
+        if self.a.closed and self.b.closed and not self.done.done():
+            self.done.set_result((self.a.bytes, self.b.bytes))
+
+    async def run(self) -> tuple[int, int]:
+        if not all(buffer_accessible(wrapper) for wrapper in self.wrappers): return await self.run_streams()
+
+        pending: list[tuple[RelayProtocol, bytes, bool]] = []
+        for wrapper, protocol in zip(self.wrappers, (self.a, self.b)):
+            data, eof = take_buffered(wrapper)
+            transport: asyncio.Transport = wrapper.writer.transport # type: ignore
+            protocol.transport = transport
+            pending.append((protocol, data, eof))
+
+        if any(protocol.transport is None or protocol.transport.is_closing() for protocol, _, _ in pending):
+            for protocol, data, _ in pending: protocol.forward(data)
+            self.close()
+            return self.a.bytes, self.b.bytes
+
+        for protocol, _, _ in pending:
+            protocol.transport.set_protocol(protocol) # type: ignore
+        for protocol, data, eof in pending:
+            protocol.forward(data)
+            if eof: protocol.eof_received()
+            elif protocol.transport: protocol.transport.resume_reading()
+
+        if self.idle_timeout: self.idle_handle = asyncio.get_running_loop().call_later(self.idle_timeout, self.check_idle)
+        try: return await self.done
+        finally:
+            if self.idle_handle: self.idle_handle.cancel()
+            self.close()
+            for wrapper in self.wrappers: wrapper.isOpen = False
+
+    async def run_streams(self) -> tuple[int, int]:
+        '''Fallback when the buffered bytes can't be taken over from the StreamReader, copies through the streams and waits on drain() for flow control'''
+        for wrapper, protocol in zip(self.wrappers, (self.a, self.b)):
+            protocol.transport = wrapper.writer.transport # type: ignore
+
+        if self.idle_timeout: self.idle_handle = asyncio.get_running_loop().call_later(self.idle_timeout, self.check_idle)
+        try:
+            a, b = self.wrappers
+            await asyncio.gather(self.copy(a, b, self.a), self.copy(b, a, self.b))
+            return self.a.bytes, self.b.bytes
+        finally:
+            if self.idle_handle: self.idle_handle.cancel()
+            self.close()
+            for wrapper in self.wrappers: wrapper.isOpen = False
+
+    async def copy(self, source: SocketWrapper, target: SocketWrapper, protocol: RelayProtocol):
+        try:
+            data = source.take_buffer()
+            while True:
+                if data:
+                    protocol.bytes += len(data)
+                    self.active = True
+                    target.writer.write(data)
+                    await target.writer.drain()
+                if source.reader.at_eof(): break
+                data = await source.reader.read(RELAY_BUFFER_SIZE)
+
+            if target.writer.can_write_eof() and not target.writer.transport.is_closing(): target.writer.write_eof()
+            else: self.close()
+        except Exception:
+            self.close()
+
+def buffer_accessible(wrapper: SocketWrapper) -> bool:
+    # asyncio.StreamReader keeps unread bytes in the private _buffer bytearray (CPython 3.8 up to at least 3.13),
+    # anything else (a different implementation or a future CPython) goes through Relay.run_streams instead
+    return isinstance(getattr(wrapper.reader, '_buffer', None), bytearray)
+
+def take_buffered(wrapper: SocketWrapper) -> tuple[bytes, bool]:
+    '''Bytes read from the socket but not consumed yet (SocketWrapper lookahead, then StreamReader._buffer), callers check buffer_accessible first'''
+    reader_buffer: bytearray = getattr(wrapper.reader, '_buffer')
+    data = wrapper.take_buffer()
+    if reader_buffer:
+        data += bytes(reader_buffer)
+        reader_buffer.clear()
+    return data, wrapper.reader.at_eof()
+
+async def relay(a: SocketWrapper, b: SocketWrapper, idle_timeout: float | None = None) -> tuple[int, int]:
+    '''Pipe two connections into each other until both are closed (or no bytes moved for idle_timeout seconds), returns the bytes sent a -> b and b -> a'''
+    return await Relay(a, b, idle_timeout).run()
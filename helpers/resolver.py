@@ -0,0 +1,128 @@
+import asyncio, socket, ssl, time, ipaddress, functools, typing
+
+DNS_CACHE_TTL = 60
+DNS_NEGATIVE_TTL = 5
+DNS_CACHE_SIZE = 1024
+HAPPY_EYEBALLS_DELAY = 0.25
+
+DNS_STATS = {'hits': 0, 'misses': 0, 'failures': 0}
+
+AddrInfo = tuple[int, int, int, str, tuple]
+CacheKey = tuple[str, int]
+
+class Resolver:
+    def __init__(self, ttl: float = DNS_CACHE_TTL, negative_ttl: float = DNS_NEGATIVE_TTL, max_size: int = DNS_CACHE_SIZE) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.entries: dict[CacheKey, tuple[float, list[AddrInfo] | tuple[type[OSError], tuple]]] = {}
+        self.inflight: dict[CacheKey, asyncio.Future[list[AddrInfo]]] = {}
+
+    async def resolve(self, host: str, port: int) -> list[AddrInfo]:
+        '''Resolve host to stream addresses, answers and failures are cached and concurrent lookups share one getaddrinfo call (cached failures raise a new exception each time, so tracebacks don't pile up on one instance)'''
+        key = (host, port)
+        entry = self.entries.get(key, None)
+        if entry and entry[0] > time.monotonic():
+            DNS_STATS['hits'] += 1
+            if isinstance(entry[1], tuple):
+                error_type, args = entry[1]
+                raise error_type(*args)
+            return entry[1]
+
+        lookup = self.inflight.get(key, None)
+        if lookup is None:
+            DNS_STATS['misses'] += 1
+            lookup = asyncio.ensure_future(asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM))
+            lookup.add_done_callback(functools.partial(self.__on_resolved, key))
+            self.inflight[key] = lookup
+        return await asyncio.shield(lookup)
+
+    def invalidate(self, host: str, port: int):
+        self.entries.pop((host, port), None)
+
+    def __on_resolved(self, key: CacheKey, lookup: asyncio.Future[list[AddrInfo]]):
+        self.inflight.pop(key, None)
+        if lookup.cancelled(): return
+
+        error = lookup.exception()
+        if error is None: self.__store(key, self.ttl, lookup.result())
+        elif isinstance(error, OSError):
+            DNS_STATS['failures'] += 1
+            self.__store(key, self.negative_ttl, (type(error), error.args))
+
+    def __store(self, key: CacheKey, ttl: float, value: list[AddrInfo] | tuple[type[OSError], tuple]):
+        now = time.monotonic()
+        if len(self.entries) >= self.max_size:
+            for expired in [item for item, (expires, _) in self.entries.items() if expires <= now]:
+                self.entries.pop(expired)
+        if len(self.entries) >= self.max_size:
+            self.entries.pop(next(iter(self.entries)))
+        self.entries[key] = (now + ttl, value)
+
+cache = Resolver()
+
+def literal_addresses(host: str, port: int) -> list[AddrInfo] | None:
+    try: address = ipaddress.ip_address(host)
+    except ValueError: return None
+    if address.version == 6: return [(socket.AF_INET6, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (host, port, 0, 0))]
+    return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (host, port))]
+
+def interleave(infos: list[AddrInfo]) -> list[AddrInfo]:
+    '''Alternate address families (RFC 8305 section 4) while keeping the resolver preference inside each family'''
+    if not infos: return []
+    first = [info for info in infos if info[0] == infos[0][0]]
+    other = [info for info in infos if info[0] != infos[0][0]]
+    ordered: list[AddrInfo] = []
+    for index in range(max(len(first), len(other))):
+        if index < len(first): ordered.append(first[index])
+        if index < len(other): ordered.append(other[index])
+    return ordered
+
+async def connect(host: str, port: int, prepare: typing.Callable[[socket.socket], None] | None = None) -> socket.socket:
+    '''Happy Eyeballs connect, a new attempt starts every HAPPY_EYEBALLS_DELAY seconds (or as soon as one fails) and the first established socket wins'''
+    infos = literal_addresses(host, port) or interleave(await cache.resolve(host, port))
+    loop = asyncio.get_running_loop()
+
+    async def attempt(info: AddrInfo) -> socket.socket:
+        family, type, proto, _, address = info
+        sock = socket.socket(family, type, proto)
+        try:
+            sock.setblocking(False)
+            if prepare: prepare(sock)
+            await loop.sock_connect(sock, address)
+            return sock
+        except BaseException:
+            sock.close()
+            raise
+
+    remaining = list(infos)
+    pending: set[asyncio.Task[socket.socket]] = set()
+    errors: list[BaseException] = []
+    winner: socket.socket | None = None
+    try:
+        while winner is None and (remaining or pending):
+            if remaining: pending.add(asyncio.create_task(attempt(remaining.pop(0))))
+            done, pending = await asyncio.wait(pending, timeout=HAPPY_EYEBALLS_DELAY if remaining else None, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is not None: errors.append(error)
+                elif winner is None: winner = task.result()
+                else: task.result().close()
+    finally:
+        for task in pending: task.cancel()
+        for late in await asyncio.gather(*pending, return_exceptions=True):
+            if isinstance(late, socket.socket): late.close()
+
+    if winner is not None: return winner
+
+    cache.invalidate(host, port)
+    if not errors: raise OSError(f'No addresses found for {host}')
+    if len(errors) == 1: raise errors[0]
+    raise OSError(f'Multiple exceptions: {", ".join(str(error) for error in errors)}')
+
+async def open_connection(host: str, port: int, ssl_context: ssl.SSLContext | None = None, prepare: typing.Callable[[socket.socket], None] | None = None) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    sock = await connect(host, port, prepare)
+    try: return await asyncio.open_connection(sock=sock, ssl=ssl_context, server_hostname=host if ssl_context else None)
+    except BaseException:
+        sock.close()
+        raise
@@ -0,0 +1,94 @@
+import asyncio, hashlib, hmac, os, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+KDF_SHA256 = 'sha256'
+KDF_PBKDF2 = 'pbkdf2'
+KDF_SCRYPT = 'scrypt'
+KDFS = [KDF_SHA256, KDF_PBKDF2, KDF_SCRYPT]
+
+DEFAULT_PARAMS = {
+    KDF_SHA256: '',
+    KDF_PBKDF2: 'iterations=600000',
+    KDF_SCRYPT: 'n=16384;r=8;p=1'
+}
+
+PBKDF2_MAX_ITERATIONS = 5_000_000
+SCRYPT_MAX_R = 32
+SCRYPT_MAX_P = 16
+SCRYPT_MAX_MEMORY = 256 * 1024 * 1024
+
+VERIFY_CACHE_TTL = 300
+VERIFY_CACHE_SIZE = 4096
+KDF_WORKERS = 2
+
+__executor = ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix='kdf')
+__cache: OrderedDict[bytes, float] = OrderedDict()
+__cache_key = os.urandom(32)
+
+def parse_params(data: str) -> dict[str, int]:
+    params: dict[str, int] = {}
+    for item in data.split(';'):
+        if not item.strip(): continue
+        key, _, value = item.partition('=')
+        params[key.strip().lower()] = int(value)
+    return params
+
+def validate(kdf: str, params: str):
+    if not kdf in KDFS: raise ValueError(f'Invalid kdf {kdf} (accepted: {", ".join(KDFS)})')
+    try: parsed = parse_params(params)
+    except Exception: raise ValueError(f'Invalid kdfParams {params}')
+
+    if kdf == KDF_PBKDF2 and not 1 <= parsed.get('iterations', 600000) <= PBKDF2_MAX_ITERATIONS:
+        raise ValueError(f'Invalid kdfParams {params}, iterations must be between 1 and {PBKDF2_MAX_ITERATIONS}')
+    if kdf == KDF_SCRYPT:
+        n, r, p = parsed.get('n', 16384), parsed.get('r', 8), parsed.get('p', 1)
+        if n < 2 or n & (n - 1): raise ValueError(f'Invalid kdfParams {params}, n must be a power of 2 greater than 1')
+        if not 1 <= r <= SCRYPT_MAX_R: raise ValueError(f'Invalid kdfParams {params}, r must be between 1 and {SCRYPT_MAX_R}')
+        if not 1 <= p <= SCRYPT_MAX_P: raise ValueError(f'Invalid kdfParams {params}, p must be between 1 and {SCRYPT_MAX_P}')
+        if scrypt_maxmem(n, r, p) > SCRYPT_MAX_MEMORY: raise ValueError(f'Invalid kdfParams {params}, needs more than {SCRYPT_MAX_MEMORY // (1024 * 1024)}MB')
+
+def scrypt_maxmem(n: int, r: int, p: int) -> int:
+    '''Memory OpenSSL asks for (128 * r * (n + p + 2) bytes) with 1MB headroom, used by both validate and derive'''
+    return 128 * r * (n + p + 2) + 1024 * 1024
+
+def derive(secret: str, salt: str, kdf: str = KDF_SHA256, params: str = '') -> str:
+    if kdf == KDF_SHA256:
+        return hashlib.sha256(f'{secret}{salt}'.encode('utf-8')).hexdigest()
+
+    parsed = parse_params(params or DEFAULT_PARAMS[kdf])
+    if kdf == KDF_PBKDF2:
+        return hashlib.pbkdf2_hmac('sha256', secret.encode('utf-8'), salt.encode('utf-8'), parsed.get('iterations', 600000)).hex()
+    if kdf == KDF_SCRYPT:
+        n, r, p = parsed.get('n', 16384), parsed.get('r', 8), parsed.get('p', 1)
+        return hashlib.scrypt(secret.encode('utf-8'), salt=salt.encode('utf-8'), n=n, r=r, p=p, maxmem=scrypt_maxmem(n, r, p)).hex()
+
+    raise ValueError(f'Invalid kdf {kdf}')
+
+def verify(hexdigest: str, secret: str, salt: str, kdf: str = KDF_SHA256, params: str = '') -> bool:
+    return hmac.compare_digest(hexdigest.lower().encode('utf-8'), derive(secret, salt, kdf, params).encode('utf-8'))
+
+async def verify_async(hexdigest: str, secret: str, salt: str, kdf: str = KDF_SHA256, params: str = '') -> bool:
+    if not isinstance(secret, str): return False
+
+    key = hmac.digest(__cache_key, f'{kdf}\0{params}\0{salt}\0{hexdigest}\0{secret}'.encode('utf-8'), 'sha256')
+    expiry = __cache.get(key, None)
+    if expiry is not None:
+        if expiry > time.monotonic():
+            __cache.move_to_end(key)
+            return True
+        __cache.pop(key, None)
+
+    try:
+        if kdf == KDF_SHA256:
+            verified = verify(hexdigest, secret, salt, kdf, params)
+        else:
+            verified = await asyncio.get_running_loop().run_in_executor(__executor, verify, hexdigest, secret, salt, kdf, params)
+    except ValueError: return False
+
+    if verified:
+        __cache[key] = time.monotonic() + VERIFY_CACHE_TTL
+        while len(__cache) > VERIFY_CACHE_SIZE:
+            __cache.popitem(last=False)
+
+    return verified
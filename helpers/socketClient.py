@@ -1,26 +1,70 @@
 import asyncio
-from helpers import SocketWrapper
+from helpers import SocketWrapper, resolver
+from helpers.socketOptions import SocketOptions
 import ssl
 
+TLS_HANDSHAKES = {'full': 0, 'resumed': 0}
+
+class SessionSSLContext(ssl.SSLContext):
+    last_connection: ssl.SSLObject | None = None
+    session: ssl.SSLSession | None = None
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None and not server_side:
+            session = self.__resumable_session()
+
+        try: return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+        except ValueError:
+            self.session = None
+            return super().wrap_bio(incoming, outgoing, server_side, server_hostname)
+
+    def __resumable_session(self):
+        last = self.last_connection
+        if last is not None and last.session is not None and (last.session.has_ticket or last.version() != 'TLSv1.3'):
+            self.session = last.session
+        return self.session
+
+__ssl_contexts: dict[tuple[str, int, bool], SessionSSLContext] = {}
+
+def get_ssl_context(host: str, port: int, ssl_disable_verify=False) -> SessionSSLContext:
+    key = (host, port, ssl_disable_verify)
+    context = __ssl_contexts.get(key, None)
+    if context: return context
+
+    context = SessionSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.load_default_certs()
+
+    if ssl_disable_verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+    __ssl_contexts[key] = context
+    return context
+
 class SocketClient:
-    def __init__(self, host: str, port: int, ssl_client=False, ssl_disable_verify=False) -> None:
+    def __init__(self, host: str, port: int, ssl_client=False, ssl_disable_verify=False, socket_options: SocketOptions | None = None) -> None:
         self.host = host
         self.port = port
+        self.socket_options = socket_options
         self.connection: SocketWrapper | None = None
 
-        self.__ssl_context = ssl.create_default_context() if ssl_client else None
-
-        if self.__ssl_context and ssl_disable_verify:
-            self.__ssl_context.check_hostname = False
-            self.__ssl_context.verify_mode = ssl.CERT_NONE
+        self.__ssl_context = get_ssl_context(host, port, ssl_disable_verify) if ssl_client else None
 
     @property
     def running(self): return self.connection is not None and bool(self.connection.isOpen)
 
     async def start(self):
-        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.__ssl_context)
+        options = self.socket_options
+        reader, writer = await resolver.open_connection(self.host, self.port, self.__ssl_context, options.prepare if options else None)
+        if options: options.apply(writer.get_extra_info('socket'), f'{self.host}:{self.port}')
         self.connection = SocketWrapper(reader, writer)
 
+        if self.__ssl_context:
+            ssl_object: ssl.SSLObject | None = writer.get_extra_info('ssl_object')
+            if ssl_object is not None:
+                TLS_HANDSHAKES['resumed' if ssl_object.session_reused else 'full'] += 1
+                self.__ssl_context.last_connection = ssl_object
+
     def stop(self):
         if not self.connection: return
         self.connection.close()
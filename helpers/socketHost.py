@@ -1,12 +1,17 @@
-import asyncio, typing, logging
+import asyncio, typing, logging, ssl
 from abc import ABC, abstractmethod
-from helpers import SocketWrapper, misc
+from helpers import SocketWrapper, fdBudget
+from helpers.taskScope import TaskScope, root
+from helpers.socketOptions import SocketOptions, DEFAULT_BACKLOG
 
 logger = logging.getLogger(__name__)
 
 AddrType = tuple[str | typing.Any, int]
 
 class SocketHost(ABC):
+    running = False
+    socket_options: SocketOptions | None = None
+
     @abstractmethod
     async def start(self):
         pass
@@ -19,15 +24,15 @@ class SocketHost(ABC):
     async def send(self, addr: tuple[str | typing.Any, int], data: bytes):
         pass
 
-def create_host(host: str, port: int, on_client: typing.Callable[[SocketWrapper], typing.Coroutine] | None, on_message: typing.Callable[[bytes, AddrType], typing.Coroutine] | None, protocol: str = 'tcp') -> SocketHost:
+def create_host(host: str, port: int, on_client: typing.Callable[[SocketWrapper], typing.Coroutine] | None, on_message: typing.Callable[[bytes, AddrType], typing.Coroutine] | None, protocol: str = 'tcp', ssl_context: ssl.SSLContext | None = None, tasks: TaskScope | None = None, socket_options: SocketOptions | None = None, shed: bool = True) -> SocketHost:
     proto = (protocol or 'tcp').lower()
     
     if proto == 'udp':
         if not on_message: raise Exception('on_message callback not found')
-        return UdpHost(host, port, on_message)
+        return UdpHost(host, port, on_message, tasks)
     if proto == 'tcp':
         if not on_client: raise Exception('on_client callback not found')
-        return TcpHost(host, port, on_client)
+        return TcpHost(host, port, on_client, ssl_context, tasks, socket_options, shed)
 
     raise NotImplementedError('Invalid protocol')
 
@@ -36,10 +41,14 @@ def create_host(host: str, port: int, on_client: typing.Callable[[SocketWrapper]
 ################
 
 class TcpHost(SocketHost):
-    def __init__(self, host: str, port: int, on_client: typing.Callable[[SocketWrapper], typing.Coroutine]) -> None:
+    def __init__(self, host: str, port: int, on_client: typing.Callable[[SocketWrapper], typing.Coroutine], ssl_context: ssl.SSLContext | None = None, tasks: TaskScope | None = None, socket_options: SocketOptions | None = None, shed: bool = True) -> None:
         self.host = host
         self.port = port
         self.on_client = on_client
+        self.ssl_context = ssl_context
+        self.socket_options = socket_options
+        self.shed = shed
+        self.tasks = tasks or root
         self.server: asyncio.Server | None = None
         self.running = False
 
@@ -47,7 +56,10 @@ class TcpHost(SocketHost):
         if self.running:
             return
         self.running = True
-        self.server = await asyncio.start_server(self.__on_client, self.host, self.port)
+        options = self.socket_options
+        self.server = await asyncio.start_server(self.__on_client, self.host, self.port, ssl=self.ssl_context, backlog=(options.backlog if options else None) or DEFAULT_BACKLOG)
+        if options:
+            for sock in self.server.sockets: options.apply_listener(sock)
     
     async def stop(self):
         if self.server:
@@ -60,17 +72,23 @@ class TcpHost(SocketHost):
     
     async def __on_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         connection = SocketWrapper(reader, writer)
-        misc.queue_task(self.on_client(connection))
+        if self.shed and not fdBudget.allows():
+            fdBudget.shed()
+            connection.close()
+            return
+
+        if not self.tasks.spawn(self.on_client(connection)): connection.close()
 
 ################
 # UDP PROTOCOL #
 ################
 
 class UdpHost(SocketHost):
-    def __init__(self, host: str, port: int, on_message: typing.Callable[[bytes, AddrType], typing.Coroutine]) -> None:
+    def __init__(self, host: str, port: int, on_message: typing.Callable[[bytes, AddrType], typing.Coroutine], tasks: TaskScope | None = None) -> None:
         self.host = host
         self.port = port
         self.on_message = on_message
+        self.tasks = tasks or root
         self.transport: asyncio.DatagramTransport | None = None
         self.running = False
     
@@ -81,7 +99,7 @@ class UdpHost(SocketHost):
         loop = asyncio.get_running_loop()
         
         self.transport, _ = await loop.create_datagram_endpoint(
-            lambda: DatagramProtocol(self.__on_client_recv),
+            lambda: DatagramProtocol(self.__on_client_recv, self.tasks),
             local_addr=(self.host, self.port)
         )
     
@@ -102,8 +120,9 @@ class UdpHost(SocketHost):
         await self.on_message(data, addr)
 
 class DatagramProtocol(asyncio.DatagramProtocol):
-    def __init__(self, on_recv: typing.Callable[[bytes, AddrType], typing.Coroutine]) -> None:
+    def __init__(self, on_recv: typing.Callable[[bytes, AddrType], typing.Coroutine], tasks: TaskScope) -> None:
         self.__on_recv = on_recv
+        self.__tasks = tasks
     
     def datagram_received(self, data: bytes, addr) -> None:
-        misc.queue_task(self.__on_recv(data, addr))
+        self.__tasks.spawn(self.__on_recv(data, addr))
@@ -0,0 +1,121 @@
+import socket, logging, typing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKLOG = 100
+
+PROFILES: dict[str, dict[str, str]] = {
+    'default': {},
+    'interactive': {'noDelay': '1', 'notSentLowat': '16384', 'keepAlive': '60;10;5'},
+    'bulk': {'noDelay': '0', 'sndBuf': '4194304', 'rcvBuf': '4194304', 'keepAlive': '300;30;5'},
+}
+
+OPTION_KEYS = ['socketProfile', 'noDelay', 'sndBuf', 'rcvBuf', 'keepAlive', 'fastOpen', 'notSentLowat', 'backlog']
+
+class SocketOptions:
+    def __init__(self, no_delay: bool | None = None, sndbuf: int | None = None, rcvbuf: int | None = None,
+                 keepalive: tuple[int, int, int] | None = None, fastopen: int | None = None,
+                 notsent_lowat: int | None = None, backlog: int | None = None) -> None:
+        self.no_delay = no_delay
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
+        self.keepalive = keepalive
+        self.fastopen = fastopen
+        self.notsent_lowat = notsent_lowat
+        self.backlog = backlog
+        self.reported = False
+
+    @staticmethod
+    def parse(options: dict[str, str] | None = None) -> 'SocketOptions':
+        '''Build from the socketProfile preset overridden by the individual columns, raises ValueError on invalid values'''
+        options = options or {}
+        profile = options.get('socketProfile') or 'default'
+        if profile not in PROFILES: raise ValueError(f'Invalid socketProfile {profile}')
+        values = {**PROFILES[profile], **{key: value for key, value in options.items() if key in OPTION_KEYS and value}}
+
+        keepalive = None
+        if values.get('keepAlive'):
+            parts = values['keepAlive'].split(';')
+            if len(parts) != 3: raise ValueError(f'Invalid keepAlive {values["keepAlive"]}, expected idle;interval;count')
+            keepalive = (to_positive(parts[0], 'keepAlive'), to_positive(parts[1], 'keepAlive'), to_positive(parts[2], 'keepAlive'))
+
+        no_delay = values.get('noDelay')
+        if no_delay not in [None, '0', '1']: raise ValueError(f'Invalid noDelay {no_delay}, expected 1/0')
+
+        return SocketOptions(
+            no_delay=None if no_delay is None else no_delay == '1',
+            sndbuf=to_positive(values.get('sndBuf'), 'sndBuf'),
+            rcvbuf=to_positive(values.get('rcvBuf'), 'rcvBuf'),
+            keepalive=keepalive,
+            fastopen=to_positive(values.get('fastOpen'), 'fastOpen'),
+            notsent_lowat=to_positive(values.get('notSentLowat'), 'notSentLowat'),
+            backlog=to_positive(values.get('backlog'), 'backlog')
+        )
+
+    @property
+    def key(self) -> tuple:
+        '''Equal for options that produce the same sockets, connections can be shared between them'''
+        return (self.no_delay, self.sndbuf, self.rcvbuf, self.keepalive, self.fastopen, self.notsent_lowat, self.backlog)
+
+    @property
+    def configured(self):
+        return any(value is not None for value in [self.no_delay, self.sndbuf, self.rcvbuf, self.keepalive, self.fastopen, self.notsent_lowat])
+
+    def prepare(self, sock: socket.socket):
+        '''Options that have to be set before connect()'''
+        if self.fastopen and hasattr(socket, 'TCP_FASTOPEN_CONNECT'):
+            set_option(sock, socket.IPPROTO_TCP, getattr(socket, 'TCP_FASTOPEN_CONNECT'), 1)
+        if self.sndbuf: set_option(sock, socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        if self.rcvbuf: set_option(sock, socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+
+    def apply_listener(self, sock: typing.Any):
+        if self.fastopen and hasattr(socket, 'TCP_FASTOPEN'):
+            set_option(sock, socket.IPPROTO_TCP, socket.TCP_FASTOPEN, self.fastopen)
+        if self.sndbuf: set_option(sock, socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        if self.rcvbuf: set_option(sock, socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+
+    def apply(self, sock: typing.Any, label: str = ''):
+        '''Apply to a connected socket, the effective values are logged once for each SocketOptions'''
+        if sock is None or not self.configured: return
+
+        if self.no_delay is not None: set_option(sock, socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.no_delay))
+        if self.sndbuf: set_option(sock, socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        if self.rcvbuf: set_option(sock, socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        if self.notsent_lowat and hasattr(socket, 'TCP_NOTSENT_LOWAT'):
+            set_option(sock, socket.IPPROTO_TCP, getattr(socket, 'TCP_NOTSENT_LOWAT'), self.notsent_lowat)
+        if self.keepalive:
+            set_option(sock, socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            for name, value in zip(['TCP_KEEPIDLE', 'TCP_KEEPINTVL', 'TCP_KEEPCNT'], self.keepalive):
+                if hasattr(socket, name): set_option(sock, socket.IPPROTO_TCP, getattr(socket, name), value)
+
+        if not self.reported:
+            self.reported = True
+            logger.info(f'Socket options{f" for {label}" if label else ""}: {", ".join(f"{key}={value}" for key, value in effective(sock).items())}')
+
+def to_positive(value: str | None, name: str) -> int | None:
+    if value is None or value == '': return None
+    try: number = int(value)
+    except ValueError: raise ValueError(f'Invalid {name} {value}, expected a positive int')
+    if number <= 0: raise ValueError(f'Invalid {name} {value}, expected a positive int')
+    return number
+
+def set_option(sock: typing.Any, level: int, option: int, value: int):
+    try: sock.setsockopt(level, option, value)
+    except OSError as e: logger.debug(f'Failed to set socket option {option}: {str(e)}')
+
+def effective(sock: typing.Any) -> dict[str, int | None]:
+    '''Read back what the kernel applied, buffer sizes are usually doubled by Linux'''
+    names = {
+        'noDelay': (socket.IPPROTO_TCP, socket.TCP_NODELAY),
+        'sndBuf': (socket.SOL_SOCKET, socket.SO_SNDBUF),
+        'rcvBuf': (socket.SOL_SOCKET, socket.SO_RCVBUF),
+        'keepAlive': (socket.SOL_SOCKET, socket.SO_KEEPALIVE),
+    }
+    for name, key in [('keepIdle', 'TCP_KEEPIDLE'), ('keepInterval', 'TCP_KEEPINTVL'), ('keepCount', 'TCP_KEEPCNT'), ('notSentLowat', 'TCP_NOTSENT_LOWAT')]:
+        if hasattr(socket, key): names[name] = (socket.IPPROTO_TCP, getattr(socket, key))
+
+    values: dict[str, int | None] = {}
+    for name, (level, option) in names.items():
+        try: values[name] = sock.getsockopt(level, option)
+        except OSError: values[name] = None
+    return values
@@ -1,8 +1,24 @@
-import asyncio
+import asyncio, socket, struct
+
+SOCKET_READ_SIZE = 64 * 1024
+MAX_BUFFER_SIZE = 4 * 1024 * 1024
+COMPACT_SIZE = 64 * 1024
+COALESCE_WINDOW = 0.0
+MAX_FRAME_QUEUE = 64 * 1024
+
+FRAME_STATS = {'frames': 0, 'writes': 0, 'urgent': 0}
+
+def set_coalesce_window(microseconds: int | None):
+    global COALESCE_WINDOW
+    COALESCE_WINDOW = max(0, microseconds or 0) / 1_000_000
 
 class SocketWrapper:
     def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
-        self.buffer = b''
+        self.__buffer = bytearray()
+        self.__offset = 0
+        self.__frames: list[bytes] = []
+        self.__frames_size = 0
+        self.__frames_handle: asyncio.Handle | None = None
         self.reader = reader
         self.writer = writer
         self.isOpen = True
@@ -14,59 +30,148 @@ class SocketWrapper:
             self.ip = client_info[0]
             self.port = client_info[1]
 
+    @property
+    def buffer(self) -> bytes:
+        return bytes(self.__buffer[self.__offset:])
+
+    @property
+    def buffered(self) -> int:
+        return len(self.__buffer) - self.__offset
+
     async def read_until(self, data: bytes):
         try:
-            if data in self.buffer:
-                buffer, self.buffer = self.buffer.split(data, 1)
-                return buffer
-
-            buffer = await self.reader.readuntil(data)
-            suffixCut = len(data) * -1
-            buffer = self.buffer + buffer[:suffixCut]
-            self.buffer = b''
-            return buffer
+            if self.__offset == len(self.__buffer):
+                try: return (await self.reader.readuntil(data))[:-len(data)]
+                except asyncio.LimitOverrunError: pass
+
+            start = self.__offset
+            while True:
+                index = self.__buffer.find(data, start)
+                if index >= 0: return self.__consume(index, len(data))
+
+                start = max(self.__offset, len(self.__buffer) - len(data) + 1)
+                if self.buffered > MAX_BUFFER_SIZE: return None
+                if not await self.__fill(): return None
         except Exception:
             return None
 
     async def readuntil_any(self, matches: list[bytes]) -> tuple[bytes, bytes]:
-        foundMatch = self.in_buffer(matches)
+        longest = max(len(match) for match in matches)
+        start = self.__offset
+        while True:
+            found: tuple[int, bytes] | None = None
+            for match in matches:
+                index = self.__buffer.find(match, start)
+                if index >= 0 and (found is None or index < found[0]): found = (index, match)
+
+            if found is not None: return self.__consume(found[0], len(found[1])), found[1]
+
+            start = max(self.__offset, len(self.__buffer) - longest + 1)
+            if len(self.__buffer) - self.__offset > MAX_BUFFER_SIZE: raise BufferError('Buffer limit reached')
 
-        while not isinstance(foundMatch, bytes):
-            self.buffer += await self.reader.read(1024)
-            foundMatch = self.in_buffer(matches)
+            chunk = await self.reader.read(SOCKET_READ_SIZE)
+            if not chunk: raise ConnectionError('Connection closed')
+            self.__buffer += chunk
 
-        resp, self.buffer = self.buffer.split(foundMatch, 1)
-        return resp, foundMatch
+    async def peek(self, size: int) -> bytes:
+        while self.buffered < size:
+            if not await self.__fill(): break
+        return bytes(self.__buffer[self.__offset:self.__offset + size])
 
     async def read_size(self, size: int, alwaysRecv: int | None = None):
         try:
-            if len(self.buffer) > 0 and alwaysRecv == None:
-                buffer = self.buffer
-                self.buffer = b''
-                return buffer
-            
-            self.buffer += await self.reader.read(size)
-            buffer, self.buffer = self.buffer, b''
-            return buffer
+            if self.buffered > 0 and alwaysRecv == None:
+                return self.take_buffer()
+
+            data = await self.reader.read(size)
+            if self.buffered == 0: return data
+
+            self.__buffer += data
+            return self.take_buffer()
         except Exception:
             return None
 
+    def take_buffer(self) -> bytes:
+        return self.__consume(len(self.__buffer), 0)
+
     def write(self, data: bytes):
+        if self.__frames: self.__write_frames()
         self.writer.write(data)
 
+    def write_frame(self, data: bytes, urgent = False):
+        '''Queue a small frame, frames queued within the same loop iteration (or COALESCE_WINDOW seconds) go out in one write.
+        Urgent frames and queues above MAX_FRAME_QUEUE bytes are written right away, flush() writes the queue and waits for the transport to drain'''
+        if urgent:
+            FRAME_STATS['urgent'] += 1
+            self.write(data)
+            return
+
+        self.__frames.append(data)
+        self.__frames_size += len(data)
+        if self.__frames_size > MAX_FRAME_QUEUE:
+            self.__write_frames()
+        elif self.__frames_handle is None:
+            loop = asyncio.get_running_loop()
+            self.__frames_handle = loop.call_later(COALESCE_WINDOW, self.__write_frames) if COALESCE_WINDOW > 0 else loop.call_soon(self.__write_frames)
+
     async def flush(self):
+        if self.__frames: self.__write_frames()
         await self.writer.drain()
 
     def close(self):
+        if self.__frames: self.__write_frames()
         self.writer.close()
         self.isOpen = False
 
+    def abort(self):
+        '''Close without a graceful shutdown, the peer receives a RST instead of a FIN'''
+        sock: socket.socket | None = self.writer.get_extra_info('socket')
+        try:
+            if sock is not None: sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        except OSError: pass
+        self.writer.transport.abort()
+        self.isOpen = False
+
     def push_back(self, data: bytes):
-        self.buffer = data + self.buffer
+        if self.__offset >= len(data):
+            self.__offset -= len(data)
+            self.__buffer[self.__offset:self.__offset + len(data)] = data
+        else:
+            self.__buffer[:self.__offset] = data
+            self.__offset = 0
 
     def in_buffer(self, matches : list[bytes], buffer : bytes | None = None):
-        if buffer is None: buffer = self.buffer
         for match in matches:
-            if match in buffer:
-                return match
+            if buffer is None and self.__buffer.find(match, self.__offset) >= 0: return match
+            if buffer is not None and match in buffer: return match
         return None
+
+    def __write_frames(self):
+        if self.__frames_handle:
+            self.__frames_handle.cancel()
+            self.__frames_handle = None
+
+        frames, self.__frames = self.__frames, []
+        self.__frames_size = 0
+        if not frames or self.writer.is_closing(): return
+        self.writer.writelines(frames)
+        FRAME_STATS['frames'] += len(frames)
+        FRAME_STATS['writes'] += 1
+
+    async def __fill(self) -> bool:
+        data = await self.reader.read(SOCKET_READ_SIZE)
+        if not data: return False
+        self.__buffer += data
+        return True
+
+    def __consume(self, end: int, skip: int) -> bytes:
+        data = bytes(self.__buffer[self.__offset:end])
+        self.__offset = end + skip
+
+        if self.__offset >= len(self.__buffer):
+            self.__buffer.clear()
+            self.__offset = 0
+        elif self.__offset > COMPACT_SIZE and self.__offset * 2 > len(self.__buffer):
+            del self.__buffer[:self.__offset]
+            self.__offset = 0
+        return data
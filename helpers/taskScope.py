@@ -0,0 +1,67 @@
+import asyncio, typing, logging
+
+logger = logging.getLogger(__name__)
+
+class TaskScope:
+    def __init__(self, name: str = '', parent: 'TaskScope | None' = None) -> None:
+        self.name = name
+        self.parent = parent
+        self.tasks: set[asyncio.Task] = set()
+        self.children: set[TaskScope] = set()
+        self.closed = False
+
+    @property
+    def active(self) -> int:
+        return len(self.tasks) + sum(child.active for child in self.children)
+
+    def spawn(self, coro: typing.Coroutine) -> asyncio.Task | None:
+        if self.closed:
+            coro.close()
+            return None
+
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.__on_done)
+        return task
+
+    async def run(self, coro: typing.Coroutine) -> typing.Any:
+        '''Run coro as a task of this scope and wait for it, returns None if the scope cancelled it'''
+        task = self.spawn(coro)
+        if task is None: return None
+        try: return await task
+        except asyncio.CancelledError:
+            current = asyncio.current_task()
+            if task.cancelled() and current is not None and not current.cancelling(): return None
+            raise
+
+    def child(self, name: str = '') -> 'TaskScope':
+        scope = TaskScope(name, self)
+        if self.closed: scope.closed = True
+        else: self.children.add(scope)
+        return scope
+
+    def cancel(self):
+        self.closed = True
+        current = asyncio.current_task()
+        for task in list(self.tasks):
+            if task is not current: task.cancel()
+        for child in list(self.children):
+            child.cancel()
+        if self.parent: self.parent.children.discard(self)
+
+    def stats(self) -> dict[str, typing.Any]:
+        return {
+            'name': self.name,
+            'tasks': len(self.tasks),
+            'children': [child.stats() for child in self.children]
+        }
+
+    def __on_done(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        if task.cancelled(): return
+
+        exception = task.exception()
+        if exception is not None:
+            logger.error(f'Unhandled exception in background task{f" ({self.name})" if self.name else ""}: {str(exception)}')
+
+root = TaskScope('root')
@@ -0,0 +1,226 @@
+import asyncio, ssl, logging, weakref, time, re, typing
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+TLS_RELOAD_INTERVAL = 60
+TLS_SESSION_TICKETS = 2
+TLS_CACHE_SIZE = 1024
+CERT_FILE = 'fullchain.pem'
+KEY_FILE = 'privkey.pem'
+
+VALID_SERVER_NAME = re.compile(r'^[a-z0-9_-]+(\.[a-z0-9_-]+)*$')
+PEM_CERTIFICATE = re.compile(r'-----BEGIN CERTIFICATE-----.+?-----END CERTIFICATE-----', re.DOTALL)
+SUBJECT_ALT_NAME_OID = b'\x06\x03\x55\x1d\x11'
+
+CertFiles = tuple[Path, Path]
+
+class CertEntry:
+    def __init__(self, files: CertFiles | None, context: ssl.SSLContext | None) -> None:
+        self.files = files
+        self.context = context
+        self.mtime: tuple[float, float] | None = None
+        self.checked = time.monotonic()
+
+class TLSServerContext:
+    def __init__(self, cert_file: str | None, key_file: str | None, cert_dir: str | None, cache_size: int = TLS_CACHE_SIZE, is_known: typing.Callable[[str], bool] | None = None) -> None:
+        self.cert_dir = Path(cert_dir) if cert_dir else None
+        self.cache_size = cache_size
+        self.is_known = is_known
+        self.context = self.__new_context()
+        self.context.sni_callback = self.__on_sni
+
+        self.default = CertEntry((Path(cert_file), Path(key_file or cert_file)), self.context) if cert_file else None
+        self.entries: OrderedDict[str, CertEntry] = OrderedDict()
+        self.unknown: OrderedDict[str, float] = OrderedDict()
+        self.pending: dict[str, asyncio.Task] = {}
+        self.loaded: weakref.WeakValueDictionary[CertFiles, CertEntry] = weakref.WeakValueDictionary()
+        self.server_names: weakref.WeakKeyDictionary[ssl.SSLObject, str] = weakref.WeakKeyDictionary()
+        self.dns_names: dict[Path, tuple[float, list[str]]] = {}
+
+        if self.default: self.__load_default()
+
+    def find_files(self, domain: str) -> CertFiles | None:
+        if not self.cert_dir or not VALID_SERVER_NAME.match(domain): return None
+
+        candidates = [domain]
+        if '.' in domain: candidates.append(domain.split('.', 1)[1])
+
+        for candidate in candidates:
+            cert_file = self.cert_dir / candidate / CERT_FILE
+            key_file = self.cert_dir / candidate / KEY_FILE
+            if not cert_file.is_file() or not key_file.is_file(): continue
+            # the parent folder only serves subdomains when its certificate is issued for *.parent
+            if candidate != domain and f'*.{candidate}' not in self.get_dns_names(cert_file): continue
+            return cert_file, key_file
+
+        return None
+
+    def get_dns_names(self, cert_file: Path) -> list[str]:
+        '''DNS names in the subjectAltName of the first certificate in cert_file, cached until the file changes'''
+        try: mtime = cert_file.stat().st_mtime
+        except OSError: return []
+
+        cached = self.dns_names.get(cert_file, None)
+        if cached is not None and cached[0] == mtime: return cached[1]
+
+        try: names = read_dns_names(cert_file)
+        except Exception as e:
+            logger.error(f'Failed to read subjectAltName of {cert_file}: {str(e)}')
+            names = []
+        self.dns_names[cert_file] = (mtime, names)
+        return names
+
+    def resolve(self, domain: str) -> ssl.SSLContext | None:
+        '''Cached certificate context for domain, never touches the disk. Unknown names are negative cached,
+        known names that are not loaded yet get the default certificate while preload runs in the background'''
+        now = time.monotonic()
+        entry = self.entries.get(domain, None)
+        if entry is not None and (entry.context is not None or now - entry.checked < TLS_RELOAD_INTERVAL):
+            self.entries.move_to_end(domain)
+            return entry.context
+
+        expiry = self.unknown.get(domain, None)
+        if expiry is not None and expiry > now: return None
+        if self.is_known and not self.is_known(domain):
+            self.unknown[domain] = now + TLS_RELOAD_INTERVAL
+            self.unknown.move_to_end(domain)
+            while len(self.unknown) > self.cache_size: self.unknown.popitem(last=False)
+            return None
+
+        self.__schedule(domain)
+        return None
+
+    async def preload(self, domain: str):
+        '''Look up and load the certificate for domain in the default executor, called when a client binds the domain'''
+        domain = domain.lower()
+        entry = self.entries.get(domain, None)
+        if entry is not None and (entry.context is not None or time.monotonic() - entry.checked < TLS_RELOAD_INTERVAL): return
+        await self.__schedule(domain)
+
+    def server_name(self, ssl_object: ssl.SSLObject | None) -> str | None:
+        if ssl_object is None: return None
+        return self.server_names.get(ssl_object, None)
+
+    async def reload(self):
+        if self.default: self.__load_default()
+        loop = asyncio.get_running_loop()
+        for files, entry in list(self.loaded.items()):
+            loaded = await loop.run_in_executor(None, self.__read, files, entry.mtime)
+            if loaded: entry.mtime, entry.context = loaded
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(TLS_RELOAD_INTERVAL)
+            await self.reload()
+
+    def __schedule(self, domain: str) -> asyncio.Task:
+        task = self.pending.get(domain, None)
+        if task is None:
+            task = self.pending[domain] = asyncio.get_running_loop().create_task(self.__load_domain(domain))
+        return task
+
+    async def __load_domain(self, domain: str):
+        loop = asyncio.get_running_loop()
+        try:
+            files = await loop.run_in_executor(None, self.find_files, domain)
+            entry = self.loaded.get(files, None) if files else None
+            if entry is None and files:
+                loaded = await loop.run_in_executor(None, self.__read, files, None)
+                if loaded:
+                    entry = CertEntry(files, loaded[1])
+                    entry.mtime = loaded[0]
+                    self.loaded[files] = entry
+            if entry is None: entry = CertEntry(files, None)
+
+            self.entries[domain] = entry
+            self.entries.move_to_end(domain)
+            while len(self.entries) > self.cache_size: self.entries.popitem(last=False)
+        except Exception as e:
+            logger.error(f'Failed to look up certificate for {domain}: {str(e)}')
+        finally:
+            self.pending.pop(domain, None)
+
+    def __read(self, files: CertFiles, mtime: tuple[float, float] | None) -> tuple[tuple[float, float], ssl.SSLContext] | None:
+        '''Blocking, runs in the executor. A new context with the chain loaded, None when unchanged since mtime or unreadable'''
+        cert_file, key_file = files
+        name = cert_file.parent.name
+        try: current = (cert_file.stat().st_mtime, key_file.stat().st_mtime)
+        except OSError as e:
+            logger.error(f'Failed to stat certificate for {name}: {str(e)}')
+            return None
+        if current == mtime: return None
+
+        context = self.__new_context()
+        try: context.load_cert_chain(cert_file, key_file)
+        except Exception as e:
+            logger.error(f'Failed to load certificate for {name}: {str(e)}')
+            return None
+        logger.info(f'Loaded certificate for {name}')
+        return current, context
+
+    def __load_default(self):
+        # the default chain lives in the listening context itself, so it is loaded in place on the loop (one file pair, only when it changed)
+        if not self.default or not self.default.files: return
+        cert_file, key_file = self.default.files
+        try: mtime = (cert_file.stat().st_mtime, key_file.stat().st_mtime)
+        except OSError as e:
+            logger.error(f'Failed to stat certificate for default: {str(e)}')
+            return
+        if self.default.mtime == mtime: return
+
+        try:
+            self.context.load_cert_chain(cert_file, key_file)
+            self.default.mtime = mtime
+            logger.info('Loaded certificate for default')
+        except Exception as e:
+            logger.error(f'Failed to load certificate for default: {str(e)}')
+
+    def __new_context(self):
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.minimum_version = ssl.TLSVersion.TLSv1_2
+        context.num_tickets = TLS_SESSION_TICKETS
+        return context
+
+    def __on_sni(self, ssl_object: ssl.SSLObject, server_name: str | None, context: ssl.SSLContext):
+        if not server_name: return None
+
+        server_name = server_name.lower()
+        self.server_names[ssl_object] = server_name
+
+        domain_context = self.resolve(server_name)
+        if domain_context is not None: ssl_object.context = domain_context
+        return None
+
+def read_der(data: bytes, offset: int) -> tuple[int, int, int]:
+    '''Tag, value start and value end of the DER element at offset'''
+    tag, length = data[offset], data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7f
+        length = int.from_bytes(data[offset:offset + size], 'big')
+        offset += size
+    if offset + length > len(data): raise ValueError('Truncated DER element')
+    return tag, offset, offset + length
+
+def read_dns_names(cert_file: Path) -> list[str]:
+    '''Minimal DER walk to the subjectAltName extension, the ssl module has no public certificate parser'''
+    pem = PEM_CERTIFICATE.search(cert_file.read_text())
+    if not pem: raise ValueError('No PEM certificate found')
+    der = ssl.PEM_cert_to_DER_cert(pem.group(0))
+
+    index = der.find(SUBJECT_ALT_NAME_OID)
+    if index < 0: return []
+    tag, start, end = read_der(der, index + len(SUBJECT_ALT_NAME_OID))
+    if tag == 0x01: tag, start, end = read_der(der, end) # critical flag
+    if tag != 0x04: raise ValueError('Invalid subjectAltName extension')
+
+    tag, start, end = read_der(der, start)
+    if tag != 0x30: raise ValueError('Invalid subjectAltName extension')
+
+    names: list[str] = []
+    while start < end:
+        tag, value_start, start = read_der(der, start)
+        if tag == 0x82: names.append(der[value_start:start].decode('ascii').lower()) # dNSName
+    return names
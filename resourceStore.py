@@ -0,0 +1,185 @@
+import sqlite3, json, time, logging, typing, bisect
+from abc import ABC, abstractmethod
+from pathlib import Path
+from helpers import CSVReader, misc
+from genericHost import GenericHost
+
+logger = logging.getLogger(__name__)
+
+RESOURCE_TYPES = ['tcp', 'http', 'udp']
+RESOURCE_COLUMNS = ['type', 'con', 'sha256hex', 'salt']
+RESOURCE_IDLE_TTL = 600
+RESOURCE_EVICT_INTERVAL = 60
+
+ResourceRow = dict[str, str]
+PortRange = tuple[int, int, ResourceRow]
+
+def resource_key(resource_type: str, con: typing.Any) -> str:
+    if resource_type in ['tcp', 'udp']:
+        port = misc.to_int(str(con), None)
+        return str(port) if port is not None else ''
+    return str(con)
+
+class ResourceStore(ABC):
+    @abstractmethod
+    def get(self, resource_type: str, con: typing.Any) -> ResourceRow | None:
+        pass
+
+    @abstractmethod
+    def reload(self, file: Path) -> 'ResourceStore':
+        pass
+
+def find_port_range(ranges: list[PortRange], port: int) -> ResourceRow | None:
+    index = bisect.bisect_right(ranges, port, key=lambda item: item[0]) - 1
+    if index < 0: return None
+    start, end, row = ranges[index]
+    if port > end: return None
+    return {**row, 'con': str(port)}
+
+class CSVResourceStore(ResourceStore):
+    def __init__(self, csvReader: CSVReader) -> None:
+        self.rows: dict[tuple[str, str], ResourceRow] = {}
+        self.ranges: dict[str, list[PortRange]] = {'tcp': [], 'udp': []}
+        for row in csvReader.data:
+            resource_type = row['type']
+            if not resource_type in RESOURCE_TYPES: continue
+
+            port_range = misc.parse_port_range(row['con']) if resource_type in self.ranges else None
+            if port_range:
+                GenericHost.validate(resource_type, str(port_range[0]), row)
+                self.ranges[resource_type].append((port_range[0], port_range[1], row))
+                continue
+
+            GenericHost.validate(resource_type, row['con'], row)
+            key = (resource_type, resource_key(resource_type, row['con']))
+            if not key in self.rows: self.rows[key] = row
+
+        for resource_type, ranges in self.ranges.items():
+            ranges.sort(key=lambda item: item[0])
+            for previous, current in zip(ranges, ranges[1:]):
+                if current[0] <= previous[1]:
+                    raise ValueError(f'Overlapping {resource_type} port ranges {previous[0]}-{previous[1]} and {current[0]}-{current[1]}')
+
+    def get(self, resource_type: str, con: typing.Any) -> ResourceRow | None:
+        key = resource_key(resource_type, con)
+        row = self.rows.get((resource_type, key), None)
+        if row is None and resource_type in self.ranges and key:
+            row = find_port_range(self.ranges[resource_type], int(key))
+        return row
+
+    def reload(self, file: Path) -> 'ResourceStore':
+        csvReader = CSVReader(file)
+        if csvReader.error: raise Exception(csvReader.error)
+        return CSVResourceStore(csvReader)
+
+class SQLiteResourceStore(ResourceStore):
+    '''Resources in a SQLite file. get() is a blocking primary key lookup on the event loop thread (tens of microseconds on a local disk),
+    it only runs when a resource is not materialised yet, so keep the file on local storage'''
+    def __init__(self, file: Path) -> None:
+        self.file = file
+        self.db = sqlite3.connect(file)
+        self.db.execute('CREATE TABLE IF NOT EXISTS resources (type TEXT NOT NULL, con TEXT NOT NULL, sha256hex TEXT NOT NULL, salt TEXT NOT NULL, options TEXT NOT NULL DEFAULT \'{}\', PRIMARY KEY (type, con))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS resource_ranges (type TEXT NOT NULL, start INTEGER NOT NULL, end INTEGER NOT NULL, sha256hex TEXT NOT NULL, salt TEXT NOT NULL, options TEXT NOT NULL DEFAULT \'{}\', PRIMARY KEY (type, start))')
+        self.db.commit()
+
+    def get(self, resource_type: str, con: typing.Any) -> ResourceRow | None:
+        key = resource_key(resource_type, con)
+        row = self.db.execute('SELECT type, con, sha256hex, salt, options FROM resources WHERE type = ? AND con = ?', (resource_type, key)).fetchone()
+        if row is None and resource_type in ['tcp', 'udp'] and key:
+            row = self.db.execute('SELECT type, ?, sha256hex, salt, options FROM resource_ranges WHERE type = ? AND start <= ? AND end >= ? ORDER BY start DESC LIMIT 1', (key, resource_type, int(key), int(key))).fetchone()
+        if row is None: return None
+
+        try: options = json.loads(row[4]) if row[4] else {}
+        except Exception: options = {}
+
+        return {**options, 'type': row[0], 'con': row[1], 'sha256hex': row[2], 'salt': row[3]}
+
+    def reload(self, file: Path) -> 'ResourceStore':
+        return self
+
+    def import_csv(self, csvReader: CSVReader) -> int:
+        store = CSVResourceStore(csvReader)
+        rows = []
+        for (resource_type, con), row in store.rows.items():
+            options = {key: value for key, value in row.items() if not key in RESOURCE_COLUMNS}
+            rows.append((resource_type, con, row['sha256hex'], row['salt'], json.dumps(options)))
+
+        ranges = []
+        for resource_type, items in store.ranges.items():
+            for start, end, row in items:
+                options = {key: value for key, value in row.items() if not key in RESOURCE_COLUMNS}
+                ranges.append((resource_type, start, end, row['sha256hex'], row['salt'], json.dumps(options)))
+
+        self.db.executemany('INSERT OR REPLACE INTO resources (type, con, sha256hex, salt, options) VALUES (?, ?, ?, ?, ?)', rows)
+        self.db.executemany('INSERT OR REPLACE INTO resource_ranges (type, start, end, sha256hex, salt, options) VALUES (?, ?, ?, ?, ?, ?)', ranges)
+        self.db.commit()
+        return len(rows) + len(ranges)
+
+class ResourceIndex:
+    def __init__(self, resource_type: str, store: ResourceStore) -> None:
+        self.resource_type = resource_type
+        self.store = store
+        self.hosts: dict[str, GenericHost] = {}
+        self.last_used: dict[str, float] = {}
+
+    def find(self, con: typing.Any) -> GenericHost | None:
+        key = resource_key(self.resource_type, con)
+        if not key: return None
+
+        self.last_used[key] = time.monotonic()
+        host = self.hosts.get(key, None)
+        if host: return host
+
+        row = self.store.get(self.resource_type, key)
+        if not row:
+            self.last_used.pop(key, None)
+            return None
+
+        try: host = GenericHost(self.resource_type, row['con'], row['sha256hex'], row['salt'], row)
+        except Exception as e:
+            logger.error(f'Invalid resource {self.resource_type} {key}: {str(e)}')
+            self.last_used.pop(key, None)
+            return None
+
+        self.hosts[key] = host
+        return host
+
+    def known(self, con: typing.Any) -> bool:
+        '''Whether con is a configured resource, without creating its host'''
+        key = resource_key(self.resource_type, con)
+        if not key: return False
+        return key in self.hosts or self.store.get(self.resource_type, key) is not None
+
+    def values(self) -> list[GenericHost]:
+        return list(self.hosts.values())
+
+    async def apply(self, store: ResourceStore) -> tuple[int, int]:
+        self.store = store
+        updated = removed = 0
+        for key, host in list(self.hosts.items()):
+            row = store.get(self.resource_type, key)
+            if row is None:
+                self.__drop(key)
+                await host.shutdown()
+                removed += 1
+            elif row != host.options:
+                try: host.configure(row['sha256hex'], row['salt'], row)
+                except Exception as e:
+                    logger.error(f'Invalid resource {self.resource_type} {key}, keeping previous configuration: {str(e)}')
+                    continue
+                updated += 1
+        return updated, removed
+
+    def evict_idle(self, ttl: float = RESOURCE_IDLE_TTL) -> int:
+        now = time.monotonic()
+        evicted = 0
+        for key, host in list(self.hosts.items()):
+            if now - self.last_used.get(key, 0) < ttl or not host.is_idle(): continue
+            self.__drop(key)
+            host.tasks.cancel()
+            evicted += 1
+        return evicted
+
+    def __drop(self, key: str):
+        self.hosts.pop(key, None)
+        self.last_used.pop(key, None)
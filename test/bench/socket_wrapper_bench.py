@@ -0,0 +1,139 @@
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(ROOT))
+
+from helpers import SocketWrapper
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class ChunkedStreamReader(asyncio.StreamReader):
+    """StreamReader that receives the next chunk only when the consumer waits for data, like a socket delivering segments"""
+
+    def __init__(self, chunks: list[bytes]):
+        super().__init__(limit=2 ** 24)
+        self.chunks = iter(chunks)
+
+    async def _wait_for_data(self, func_name):
+        chunk = next(self.chunks, None)
+        if chunk is None: self.feed_eof()
+        else: self.feed_data(chunk)
+
+
+class FakeTransport:
+    def get_extra_info(self, name, default=None):
+        return default
+
+
+class FakeWriter:
+    transport = FakeTransport()
+
+
+def split(data: bytes, size: int) -> list[bytes]:
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def new_wrapper(data: bytes, chunk_size: int) -> SocketWrapper:
+    return SocketWrapper(ChunkedStreamReader(split(data, chunk_size)), FakeWriter()) # type: ignore
+
+
+async def bench_read_until(frames: int, frame_size: int, chunk_size: int) -> dict:
+    frame = base64.b64encode(b'x' * frame_size) + b';'
+    wrapper = new_wrapper(frame * frames, chunk_size)
+
+    started = time.perf_counter()
+    count = 0
+    while await wrapper.read_until(b';'):
+        count += 1
+    elapsed = time.perf_counter() - started
+    return {'frames': count, 'chunk_size': chunk_size, 'seconds': round(elapsed, 4), 'frames_per_s': round(count / elapsed)}
+
+
+async def bench_read_until_buffered(frames: int, frame_size: int) -> dict:
+    frame = base64.b64encode(b'x' * frame_size) + b';'
+    wrapper = new_wrapper(b'', 1)
+    wrapper.push_back(frame * frames)
+
+    started = time.perf_counter()
+    count = 0
+    while count < frames and await wrapper.read_until(b';'):
+        count += 1
+    elapsed = time.perf_counter() - started
+    return {'frames': count, 'seconds': round(elapsed, 4), 'frames_per_s': round(count / elapsed)}
+
+
+async def bench_readuntil_any(requests: int, header_count: int, chunk_size: int) -> dict:
+    head = b'GET / HTTP/1.1\r\nHost: bench.example.local\r\n' + b''.join(b'X-Header-%d: %s\r\n' % (i, b'v' * 40) for i in range(header_count)) + b'\r\n'
+    wrapper = new_wrapper(head * requests, chunk_size)
+
+    started = time.perf_counter()
+    count = 0
+    try:
+        while True:
+            await wrapper.readuntil_any([b'\r\n\r\n', b'\n\n'])
+            count += 1
+            if count == requests: break
+    except Exception:
+        pass
+    elapsed = time.perf_counter() - started
+    return {'requests': count, 'head_size': len(head), 'chunk_size': chunk_size, 'seconds': round(elapsed, 4), 'requests_per_s': round(count / elapsed)}
+
+
+async def bench_read_size(total_mb: int, chunk_size: int) -> dict:
+    wrapper = new_wrapper(b'x' * (total_mb * 1024 * 1024), chunk_size)
+
+    started = time.perf_counter()
+    received = 0
+    while True:
+        data = await wrapper.read_size(chunk_size)
+        if not data: break
+        received += len(data)
+    elapsed = time.perf_counter() - started
+    return {'bytes': received, 'chunk_size': chunk_size, 'seconds': round(elapsed, 4), 'mb_per_s': round(received / elapsed / 1024 / 1024, 1)}
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+async def main(args: argparse.Namespace):
+    results = {
+        'read_until_pipelined': await bench_read_until(args.frames, 150, 64 * 1024),
+        'read_until_fragmented': await bench_read_until(args.frames // 10, 16 * 1024, 1024),
+        'read_until_buffered': await bench_read_until_buffered(args.frames // 10, 150),
+        'readuntil_any_headers': await bench_readuntil_any(args.requests, 20, 512),
+        'read_size': await bench_read_size(args.bulk_mb, 64 * 1024)
+    }
+    report = {'revision': git_revision(), 'python': sys.version.split()[0], 'results': results}
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+        logger.info(f'Results written to {args.output}')
+    print(output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Microbenchmark for SocketWrapper buffering')
+    parser.add_argument('--frames', type=int, default=50000, help='Control frames for read_until (default: 50000)')
+    parser.add_argument('--requests', type=int, default=5000, help='HTTP heads for readuntil_any (default: 5000)')
+    parser.add_argument('--bulk-mb', type=int, default=256, help='MB read through read_size (default: 256)')
+    parser.add_argument('--output', help='Write JSON results to this file')
+
+    asyncio.run(main(parser.parse_args()))
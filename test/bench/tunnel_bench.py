@@ -0,0 +1,423 @@
+import argparse
+import asyncio
+import datetime
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).parent.parent.parent
+AUTH = 'bench'
+SALT = 'bench'
+HTTP_DOMAIN = 'bench.example.local'
+CHUNK_SIZE = 64 * 1024
+
+
+def percentiles(samples: list[float]) -> dict[str, float | None]:
+    if not samples:
+        return {'p50': None, 'p90': None, 'p99': None, 'max': None}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        'p50': round(pick(0.50) * 1000, 3),
+        'p90': round(pick(0.90) * 1000, 3),
+        'p99': round(pick(0.99) * 1000, 3),
+        'max': round(ordered[-1] * 1000, 3)
+    }
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def free_udp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class ProcessStats:
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    def cpu_seconds(self) -> float | None:
+        try:
+            with open(f'/proc/{self.pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / self.clock_ticks
+        except Exception:
+            return None
+
+    def memory(self) -> dict[str, int | None]:
+        result: dict[str, int | None] = {'rss_kb': None, 'peak_rss_kb': None}
+        try:
+            with open(f'/proc/{self.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'): result['rss_kb'] = int(line.split()[1])
+                    elif line.startswith('VmHWM:'): result['peak_rss_kb'] = int(line.split()[1])
+        except Exception:
+            pass
+        return result
+
+
+class EchoApps:
+    """Minimal echo apps without per-message logging, so they don't dominate the measurement"""
+
+    def __init__(self):
+        self.tcp_port = free_port()
+        self.http_port = free_port()
+        self.udp_port = free_udp_port()
+        self.servers = []
+        self.udp_transport = None
+
+    async def start(self):
+        self.servers.append(await asyncio.start_server(self.handle_tcp, '127.0.0.1', self.tcp_port))
+        self.servers.append(await asyncio.start_server(self.handle_http, '127.0.0.1', self.http_port))
+
+        loop = asyncio.get_running_loop()
+        self.udp_transport, _ = await loop.create_datagram_endpoint(
+            lambda: UdpEchoProtocol(),
+            local_addr=('127.0.0.1', self.udp_port)
+        )
+
+    def stop(self):
+        for server in self.servers:
+            server.close()
+        if self.udp_transport:
+            self.udp_transport.close()
+
+    async def handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                data = await reader.read(CHUNK_SIZE)
+                if not data: break
+                writer.write(data)
+                await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        body = b'ok'
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s' % (len(body), body))
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+
+class UdpEchoProtocol(asyncio.DatagramProtocol):
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        self.transport.sendto(data, addr)
+
+
+class UdpCounter(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.received = 0
+        self.latencies: list[float] = []
+
+    def datagram_received(self, data: bytes, addr):
+        self.received += 1
+        try:
+            self.latencies.append(time.perf_counter() - float(data.split(b';', 1)[0]))
+        except Exception:
+            pass
+
+
+class TunnelBench:
+    def __init__(self, args: argparse.Namespace, event_loop: str = 'auto'):
+        self.args = args
+        self.event_loop = event_loop
+        self.apps = EchoApps()
+        self.workdir = Path(tempfile.mkdtemp(prefix='dtl-bench-'))
+        self.bridge_port = free_port()
+        self.http_port = free_port()
+        self.tunnel_tcp_port = free_port()
+        self.tunnel_udp_port = free_udp_port()
+        self.processes: dict[str, subprocess.Popen] = {}
+
+    def write_config(self):
+        sha256hex = hashlib.sha256(f'{AUTH}{SALT}'.encode('utf-8')).hexdigest()
+        (self.workdir / 'servers.csv').write_text(
+            'type,con,sha256hex,salt,maxClients\n'
+            f'tcp,{self.tunnel_tcp_port},{sha256hex},{SALT},1\n'
+            f'http,{HTTP_DOMAIN},{sha256hex},{SALT},1\n'
+            f'udp,{self.tunnel_udp_port},{sha256hex},{SALT},1\n'
+        )
+        (self.workdir / 'client.csv').write_text(
+            'appType,appHost,appPort,serverTarget,serverAuth,pools\n'
+            f'tcp,127.0.0.1,{self.apps.tcp_port},{self.tunnel_tcp_port},{AUTH},{self.args.pools}\n'
+            f'http,127.0.0.1,{self.apps.http_port},{HTTP_DOMAIN},{AUTH},{self.args.pools}\n'
+            f'udp,127.0.0.1,{self.apps.udp_port},{self.tunnel_udp_port},{AUTH},{self.args.pools}\n'
+        )
+
+    def spawn(self, name: str, argv: list[str]):
+        log = open(self.workdir / f'{name}.log', 'wb')
+        self.processes[name] = subprocess.Popen([sys.executable, *argv], cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+
+    async def start(self):
+        await self.apps.start()
+        self.write_config()
+
+        db = str(self.workdir / 'resources.sqlite')
+        subprocess.run([sys.executable, 'tunnelHost.py', '--resourceDB', db, '--importCSV', str(self.workdir / 'servers.csv')], cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+
+        self.spawn('host', ['tunnelHost.py', '--resourceDB', db, '--tcpPort', str(self.bridge_port), '--httpPort', str(self.http_port), '--eventLoop', self.event_loop, *self.args.host_args.split()])
+        await asyncio.sleep(0.5)
+        self.spawn('client', ['tunnelClient.py', '--config', str(self.workdir / 'client.csv'), '--serverHost', '127.0.0.1', '--bridgePort', str(self.bridge_port), '--eventLoop', self.event_loop, *self.args.client_args.split()])
+        await self.wait_ready()
+
+    async def wait_ready(self, timeout: float = 15):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', self.tunnel_tcp_port)
+                writer.write(b'ready')
+                await writer.drain()
+                data = await asyncio.wait_for(reader.readexactly(5), 2)
+                writer.close()
+                if data == b'ready': return
+            except Exception:
+                await asyncio.sleep(0.2)
+        raise TimeoutError(f'Tunnel not ready after {timeout}s, see logs in {self.workdir}')
+
+    def stop(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            try: process.wait(5)
+            except subprocess.TimeoutExpired: process.kill()
+        self.apps.stop()
+
+    async def bench_connect(self) -> dict:
+        latencies: list[float] = []
+        errors = 0
+        for _ in range(self.args.connects):
+            started = time.perf_counter()
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', self.tunnel_tcp_port)
+                writer.write(b'x')
+                await writer.drain()
+                await asyncio.wait_for(reader.readexactly(1), 10)
+                latencies.append(time.perf_counter() - started)
+                writer.close()
+            except Exception:
+                errors += 1
+        return {'connections': self.args.connects, 'errors': errors, 'latency_ms': percentiles(latencies)}
+
+    async def bench_bulk(self) -> dict:
+        total = self.args.bulk_mb * 1024 * 1024
+        per_stream = max(total // self.args.streams, CHUNK_SIZE)
+        payload = os.urandom(CHUNK_SIZE)
+        errors = 0
+
+        async def stream():
+            nonlocal errors
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', self.tunnel_tcp_port)
+
+                async def send():
+                    sent = 0
+                    while sent < per_stream:
+                        writer.write(payload[:min(CHUNK_SIZE, per_stream - sent)])
+                        sent += min(CHUNK_SIZE, per_stream - sent)
+                        await writer.drain()
+
+                async def receive():
+                    received = 0
+                    while received < per_stream:
+                        data = await reader.read(CHUNK_SIZE)
+                        if not data: raise ConnectionError('Stream closed early')
+                        received += len(data)
+
+                await asyncio.wait_for(asyncio.gather(send(), receive()), self.args.timeout)
+                writer.close()
+            except Exception:
+                errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[stream() for _ in range(self.args.streams)])
+        elapsed = time.perf_counter() - started
+        moved = per_stream * self.args.streams
+        return {
+            'streams': self.args.streams,
+            'bytes_per_direction': moved,
+            'seconds': round(elapsed, 3),
+            'mb_per_s': round(moved / elapsed / 1024 / 1024, 2),
+            'errors': errors
+        }
+
+    async def bench_http(self) -> dict:
+        latencies: list[float] = []
+        errors = 0
+        remaining = self.args.http_requests
+        request = f'GET / HTTP/1.1\r\nHost: {HTTP_DOMAIN}\r\nConnection: close\r\n\r\n'.encode('utf-8')
+
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                started = time.perf_counter()
+                try:
+                    reader, writer = await asyncio.open_connection('127.0.0.1', self.http_port)
+                    writer.write(request)
+                    await writer.drain()
+                    data = await asyncio.wait_for(reader.read(), 10)
+                    writer.close()
+                    if not data.startswith(b'HTTP/1.1 200'): raise ConnectionError('Bad response')
+                    latencies.append(time.perf_counter() - started)
+                except Exception:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(self.args.http_concurrency)])
+        elapsed = time.perf_counter() - started
+        return {
+            'requests': self.args.http_requests,
+            'concurrency': self.args.http_concurrency,
+            'requests_per_s': round(len(latencies) / elapsed, 1),
+            'latency_ms': percentiles(latencies),
+            'errors': errors
+        }
+
+    async def bench_udp(self) -> dict:
+        loop = asyncio.get_running_loop()
+        transport, counter = await loop.create_datagram_endpoint(UdpCounter, local_addr=('127.0.0.1', 0))
+        interval = 1 / self.args.udp_rate if self.args.udp_rate > 0 else 0
+        padding = b'x' * self.args.udp_size
+
+        transport.sendto(b'0;warmup', ('127.0.0.1', self.tunnel_udp_port))
+        await asyncio.sleep(0.5)
+        counter.received = 0
+        counter.latencies.clear()
+
+        started = time.perf_counter()
+        for i in range(self.args.udp_packets):
+            transport.sendto(str(time.perf_counter()).encode('utf-8') + b';' + padding, ('127.0.0.1', self.tunnel_udp_port))
+            if interval:
+                delay = started + (i + 1) * interval - time.perf_counter()
+                if delay > 0: await asyncio.sleep(delay)
+            elif i % 100 == 0:
+                await asyncio.sleep(0)
+        sent_elapsed = time.perf_counter() - started
+
+        await asyncio.sleep(1)
+        transport.close()
+        return {
+            'packets': self.args.udp_packets,
+            'received': counter.received,
+            'loss_pct': round(100 - counter.received / self.args.udp_packets * 100, 2),
+            'send_pps': round(self.args.udp_packets / sent_elapsed, 1),
+            'latency_ms': percentiles(counter.latencies)
+        }
+
+    async def run(self) -> dict:
+        await self.start()
+        stats = {name: ProcessStats(process.pid) for name, process in self.processes.items()}
+        results: dict = {}
+        try:
+            for name, scenario in [('connect', self.bench_connect), ('bulk', self.bench_bulk), ('http', self.bench_http), ('udp', self.bench_udp)]:
+                if name in self.args.skip: continue
+                cpu_before = {key: value.cpu_seconds() for key, value in stats.items()}
+                started = time.perf_counter()
+                logger.info(f'Running {name}')
+                results[name] = await scenario()
+                elapsed = time.perf_counter() - started
+
+                results[name]['cpu_pct'] = {}
+                for key, value in stats.items():
+                    before, after = cpu_before[key], value.cpu_seconds()
+                    results[name]['cpu_pct'][key] = round((after - before) / elapsed * 100, 1) if before is not None and after is not None else None
+
+            results['memory'] = {name: value.memory() for name, value in stats.items()}
+        except Exception:
+            logger.error(f'Benchmark failed, logs kept in {self.workdir}')
+            raise
+        finally:
+            self.stop()
+
+        shutil.rmtree(self.workdir, ignore_errors=True)
+        return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+async def main(args: argparse.Namespace):
+    runs = {}
+    for event_loop in args.event_loops:
+        if event_loop == 'uvloop' and importlib.util.find_spec('uvloop') is None:
+            logger.warning('uvloop is not installed, skipping')
+            runs[event_loop] = None
+            continue
+        logger.info(f'Benchmarking with event loop {event_loop}')
+        runs[event_loop] = await TunnelBench(args, event_loop).run()
+
+    results = runs[args.event_loops[0]] if len(runs) == 1 else runs
+    report = {
+        'revision': git_revision(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'results': results
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+        logger.info(f'Results written to {args.output}')
+    print(output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark tunnelHost + tunnelClient on loopback')
+    parser.add_argument('--connects', type=int, default=200, help='Sequential connections for connect latency (default: 200)')
+    parser.add_argument('--streams', type=int, default=8, help='Concurrent TCP streams for bulk transfer (default: 8)')
+    parser.add_argument('--bulk-mb', type=int, default=64, help='Total MB echoed through the bulk streams (default: 64)')
+    parser.add_argument('--http-requests', type=int, default=500, help='HTTP requests to send (default: 500)')
+    parser.add_argument('--http-concurrency', type=int, default=16, help='Concurrent HTTP requests (default: 16)')
+    parser.add_argument('--udp-packets', type=int, default=5000, help='UDP packets to send (default: 5000)')
+    parser.add_argument('--udp-rate', type=int, default=2000, help='UDP packets per second, 0 for unthrottled (default: 2000)')
+    parser.add_argument('--udp-size', type=int, default=256, help='UDP payload padding in bytes (default: 256)')
+    parser.add_argument('--pools', type=int, default=1, help='UDP pools for the tunnel client (default: 1)')
+    parser.add_argument('--timeout', type=float, default=120, help='Timeout per bulk stream in seconds (default: 120)')
+    parser.add_argument('--skip', nargs='*', default=[], choices=['connect', 'bulk', 'http', 'udp'], help='Scenarios to skip')
+    parser.add_argument('--event-loops', nargs='+', default=['auto'], choices=['auto', 'asyncio', 'uvloop'], help='Event loops to benchmark, results are keyed by loop when several are given (default: auto)')
+    parser.add_argument('--host-args', default='', help='Extra arguments for tunnelHost.py')
+    parser.add_argument('--client-args', default='', help='Extra arguments for tunnelClient.py')
+    parser.add_argument('--output', help='Write JSON results to this file')
+
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        logger.info("Shutting down...")
@@ -1,6 +1,11 @@
-import asyncio, sys, datetime, logging, typing
-from helpers import misc, SocketClient
+import asyncio, sys, os, datetime, logging, typing, random, functools
+from pathlib import Path
+from helpers import misc, relay, eventLoop, fdBudget, SocketClient, ConnectionPool, CSVReader
 from helpers.socketHost import UdpHost, AddrType
+from helpers.socketOptions import SocketOptions
+from helpers.socketWrapper import set_coalesce_window
+from helpers.socketClient import TLS_HANDSHAKES
+from helpers.resolver import DNS_STATS
 
 logger = logging.getLogger(__name__)
 
@@ -8,6 +13,11 @@ class QuitException(Exception): pass
 
 WATCHDOG_TIMEOUT = 60
 WATCHDOG_SLEEP_FACTOR = 0.5
+RECONNECT_MIN_DELAY = 0.05
+RECONNECT_MAX_DELAY = 10
+STATS_INTERVAL = 60
+
+APP_DIAL_STATS = {'failed': 0, 'timeout': 0}
 
 class UDPSession:
     def __init__(self, host: str, port: int, on_message: typing.Callable[[bytes, AddrType, 'UDPSession'], typing.Coroutine]):
@@ -103,21 +113,18 @@ class UDPSessions:
         await asyncio.gather(*tasks)
 
 
-class TunnelClient:
+class TunnelResource:
     def __init__(
             self,
-            server_host: str, server_port: str, server_ssl: bool, server_ssl_unsafe: bool,
             app_host: str, app_port: str, app_ssl: bool, app_ssl_unsafe: bool,
-            target_type: str, target: str, password: str, auth: str, pool_count: str):
-        self.server_host = server_host
+            target_type: str, target: str, password: str, auth: str, pool_count: str, weight: str = '',
+            app_pool: str = '', app_max_connections: str = '', socket_options: SocketOptions | None = None):
         self.app_host = app_host
         self.target_type = target_type.lower()
         self.target = target
         self.password = password
         self.auth = auth
 
-        self.server_ssl = server_ssl
-        self.server_ssl_unsafe = server_ssl_unsafe
         self.app_ssl = app_ssl
         self.app_ssl_unsafe = app_ssl_unsafe
 
@@ -128,33 +135,90 @@ class TunnelClient:
             try: misc.validate_port(self.target)
             except Exception as e: raise QuitException(f'Target port error: {str(e)}')
 
-        server_port_int = misc.to_int(server_port, None)
         app_port_int = misc.to_int(app_port, None)
         self.pool_count = misc.to_int(pool_count, None) or 1
+        self.weight = misc.to_int(weight, None) or 1
 
-        if server_port_int is None: raise QuitException('Server port have to be an int')
         if app_port_int is None: raise QuitException('App port have to be an int')
 
         if self.target_type == 'udp' and self.pool_count < 1:
             raise QuitException('UDP protocol require at least 1 UDP pool connection')
 
-        self.server_port = server_port_int
         self.app_port = app_port_int
 
-        try: misc.validate_port(self.server_port)
-        except Exception as e: raise QuitException(f'Server port error: {str(e)}')
         try: misc.validate_port(self.app_port)
         except Exception as e: raise QuitException(f'App port error: {str(e)}')
 
-        self.client = SocketClient(self.server_host, self.server_port, ssl_client=server_ssl, ssl_disable_verify=self.server_ssl_unsafe)
+        self.key = (self.target_type, str(self.target))
         self.pools: list[SocketClient] = []
         self.pool_index = -1
+        self.session_id: str | None = None
+        self.bound = False
+        self.failed = False
+        self.udp_sessions: UDPSessions | None = None
+        self.socket_options = socket_options or SocketOptions()
+        self.app_pool = ConnectionPool(
+            self.app_host, self.app_port, self.app_ssl, self.app_ssl_unsafe,
+            misc.to_int(app_pool, None) or 0, misc.to_int(app_max_connections, None) or 0, self.socket_options)
+
+    def authenticate_payload(self):
+        payload = {
+            'type': self.target_type,
+            'resource': self.target,
+            'secret': self.password,
+            'weight': self.weight
+        }
+
+        if self.password:
+            payload['auth'] = self.auth
+
+        if self.session_id:
+            payload['session'] = self.session_id
+
+        return payload
+
+    def has_pool(self):
+        return len(self.pools) > 0
+
+    def get_pool(self):
+        '''Next pool connection in round robin order (advances pool_index, use has_pool to only check)'''
+        count = len(self.pools)
+        if count == 0: return None
+        self.pool_index = index = (self.pool_index + 1) % count
+        return self.pools[index]
+
+class TunnelClient:
+    def __init__(self, server_host: str, server_port: str, server_ssl: bool, server_ssl_unsafe: bool, resources: list[TunnelResource], bridge_pool: str = ''):
+        self.server_host = server_host
+        self.resources = resources
+
+        self.server_ssl = server_ssl
+        self.server_ssl_unsafe = server_ssl_unsafe
+
+        if len(self.resources) == 0: raise QuitException('No resources to bind')
+
+        server_port_int = misc.to_int(server_port, None)
+        if server_port_int is None: raise QuitException('Server port have to be an int')
+
+        self.server_port = server_port_int
+
+        try: misc.validate_port(self.server_port)
+        except Exception as e: raise QuitException(f'Server port error: {str(e)}')
+
+        self.client = SocketClient(self.server_host, self.server_port, ssl_client=server_ssl, ssl_disable_verify=self.server_ssl_unsafe)
+        self.bridge_pool_size = misc.to_int(bridge_pool, None) or 0
+        self.bridge_pools: dict[tuple, ConnectionPool] = {}
 
         self.last_data = datetime.datetime.now()
 
         self.watchdog: asyncio.Task | None = None
+        self.reporter: asyncio.Task | None = None
 
-        self.udp_sessions = UDPSessions(self.__handle_session_message)
+        self.reconnect_delay = 0.0
+
+        for resource in self.resources:
+            if resource.target_type == 'udp':
+                resource.udp_sessions = UDPSessions(functools.partial(self.__handle_session_message, resource))
 
     async def start(self):
         if self.client.running:
@@ -163,52 +227,78 @@ class TunnelClient:
 
         if self.watchdog is None:
             self.watchdog = asyncio.create_task(self.__watchdog())
+        if self.reporter is None:
+            self.reporter = asyncio.create_task(self.__report())
 
         self.__registerDataTime()
-        payload = {
-            'type': self.target_type,
-            'resource': self.target,
-            'secret': self.password,
-            'command': 'authenticate'
-        }
 
-        if self.password:
-            payload['auth'] = self.auth
+        if len(self.resources) == 1:
+            payload = self.resources[0].authenticate_payload()
+            payload['command'] = 'authenticate'
+        else:
+            payload = {
+                'command': 'authenticate_many',
+                'resources': [resource.authenticate_payload() for resource in self.resources if not resource.failed]
+            }
 
-        serializedPayload = misc.serialize(payload) + b';'
+        for resource in self.resources:
+            resource.bound = False
 
-        resp = None
         if self.client.connection:
-            self.client.connection.write(serializedPayload)
+            self.client.connection.write_frame(misc.serialize(payload) + b';')
             await self.client.connection.flush()
-            resp = await self.client.connection.read_until(b';')
 
-        if not resp:
-            raise QuitException('Failed to authenticate')
+        await self.__listen()
 
-        respData = misc.deserialize(resp)
-        if not isinstance(respData, dict) or not 'code' in respData or not 'message' in respData:
-            return
-        
-        respCode = respData.get('code')
-        respMsg = respData.get('message')
+        # explicit rejections already raised QuitException in __handle_auth_response, a closed connection is retried with backoff
+        if not any(resource.bound for resource in self.resources):
+            raise ConnectionError('Connection closed before authentication')
+
+    def get_bridge_pool(self, resource: TunnelResource) -> ConnectionPool:
+        '''Bridge connections are dialed with the resource socket options (fastOpen and buffers have to be set before connect), resources with equal options share one pool'''
+        key = resource.socket_options.key
+        pool = self.bridge_pools.get(key, None)
+        if pool is None:
+            pool = self.bridge_pools[key] = ConnectionPool(self.server_host, self.server_port, self.server_ssl, self.server_ssl_unsafe, self.bridge_pool_size, socket_options=resource.socket_options)
+        return pool
+
+    def find_resource(self, target_type: typing.Any, target: typing.Any) -> TunnelResource | None:
+        if len(self.resources) == 1 and target is None:
+            return self.resources[0]
+        key = (target_type, str(target))
+        return misc.find_first(self.resources, lambda resource: resource.key == key)
+
+    async def __handle_auth_response(self, data: dict):
+        resource = self.find_resource(data.get('type'), data.get('resource'))
+        if not resource: return
+
+        respCode = data.get('code')
+        respMsg = data.get('message')
 
         logger.info(respMsg)
 
         if respCode != 'OK':
-            raise QuitException(f'Connection failed: {respMsg} ({respCode})')
-        
-        if self.client.connection and self.target_type == 'udp':
-            await self.__send_add_pool_command()
+            resource.failed = True
+            if all(resource.failed for resource in self.resources):
+                raise QuitException(f'Connection failed: {respMsg} ({respCode})')
+            logger.error(f'Connection failed: {respMsg} ({respCode})')
+            return
 
-        await self.__listen()
+        resource.session_id = data.get('session', None)
+        resource.bound = True
+        self.reconnect_delay = 0.0
+        if resource.target_type != 'udp':
+            resource.app_pool.start()
+            self.get_bridge_pool(resource).start()
+
+        if self.client.connection and resource.target_type == 'udp' and not resource.has_pool():
+            await self.__send_add_pool_command(resource)
     
-    async def __send_add_pool_command(self):
+    async def __send_add_pool_command(self, resource: TunnelResource):
         if not self.client.connection:
             logger.warning('Client connection not started')
             return
-        self.client.connection.write(misc.serialize({ 'command': 'add_pool' }) + b';')
-        await self.client.connection.flush()
+        self.client.connection.write_frame(misc.serialize({ 'command': 'add_pool', 'type': resource.target_type, 'resource': resource.target }) + b';')
 
     async def __listen(self):
         con = self.client.connection
@@ -225,71 +315,108 @@ class TunnelClient:
                 await self.__handle_listen_payload(data)
 
     async def __handle_listen_payload(self, data: dict):
+        if 'code' in data and 'message' in data:
+            await self.__handle_auth_response(data)
+            return
+
         command_type = data.get('type')
         if command_type == 'ping':
             if self.client.connection:
-                self.client.connection.write(misc.serialize({'type': 'pong'}) + b';')
+                self.client.connection.write_frame(misc.serialize({'type': 'pong'}) + b';', urgent=True)
                 await self.client.connection.flush()
             return
 
         identifier = data.get('identifier')
         command = data.get('command')
 
-        if isinstance(identifier, str):
-            if command == 'new_request': misc.queue_task(self.__connect_new_client(identifier))
-            elif command == 'new_pool': misc.queue_task(self.__connect_new_pool(identifier))
+        if not isinstance(identifier, str): return
 
-    async def __connect_new_client(self, identifier: str):
-        server = SocketClient(self.server_host, self.server_port, ssl_client=self.server_ssl, ssl_disable_verify=self.server_ssl_unsafe)
-        application = SocketClient(self.app_host, self.app_port, ssl_client=self.app_ssl, ssl_disable_verify=self.app_ssl_unsafe)
-        
-        await asyncio.gather(server.start(), application.start())
+        if command == 'new_request':
+            resource = self.find_resource(command_type, data.get('resource'))
+            if resource: misc.queue_task(self.__connect_new_client(resource, identifier))
+        elif command == 'new_pool':
+            resource = self.find_resource(command_type, data.get('target'))
+            if resource: misc.queue_task(self.__connect_new_pool(resource, identifier))
 
-        if not server.connection: raise Exception('Connection not opened')
+    async def __connect_new_client(self, resource: TunnelResource, identifier: str):
+        if not fdBudget.allows():
+            fdBudget.shed()
+            await self.__send_reject(resource, identifier)
+            return
+
+        # wait for an appMaxConnections slot before holding a bridge connection (and a descriptor on the host) for this visitor
+        await resource.app_pool.reserve()
+        bridge_pool = self.get_bridge_pool(resource)
+        server_start = asyncio.ensure_future(bridge_pool.acquire())
+        try: application = await resource.app_pool.acquire(reserved=True)
+        except BaseException as e:
+            server_start.cancel()
+            for server in await asyncio.gather(server_start, return_exceptions=True):
+                if isinstance(server, SocketClient): bridge_pool.release(server)
+            if not isinstance(e, Exception): raise
+
+            APP_DIAL_STATS['timeout' if isinstance(e, TimeoutError) else 'failed'] += 1
+            logger.warning(f'Failed to connect to app {resource.app_host}:{resource.app_port}, rejecting visitor: {str(e) or type(e).__name__}')
+            await self.__send_reject(resource, identifier)
+            return
+
+        try: server = await server_start
+        except BaseException:
+            resource.app_pool.release(application)
+            raise
+
+        if not server.connection:
+            bridge_pool.release(server)
+            resource.app_pool.release(application)
+            raise Exception('Connection not opened')
 
         payload = {
-            'type': self.target_type,
-            'resource': self.target,
+            'type': resource.target_type,
+            'resource': resource.target,
             'command': 'bind',
             'identifier': identifier
         }
         server.connection.write(misc.serialize(payload) + b';')
         await server.connection.flush()
 
-        await asyncio.gather(
-            self.__passthrough(server, application),
-            self.__passthrough(application, server)
-        )
+        try:
+            if not application.connection: raise Exception('Connection not opened')
+            await relay(server.connection, application.connection)
+        finally:
+            bridge_pool.release(server)
+            resource.app_pool.release(application)
+
+    async def __send_reject(self, resource: TunnelResource, identifier: str):
+        if not self.client.connection: return
+        self.client.connection.write_frame(misc.serialize({ 'command': 'reject', 'type': resource.target_type, 'resource': resource.target, 'identifier': identifier }) + b';')
 
-    async def __connect_new_pool(self, identifier: str):
-        if len(self.pools) + 2 < self.pool_count:
-            await self.__send_add_pool_command()
+    async def __connect_new_pool(self, resource: TunnelResource, identifier: str):
+        if len(resource.pools) + 2 < resource.pool_count:
+            await self.__send_add_pool_command(resource)
 
         server = SocketClient(self.server_host, self.server_port, self.server_ssl, self.server_ssl_unsafe)
         await server.start()
 
         if not server.connection: raise Exception('Connection not opened')
 
-        self.pools.append(server)
+        resource.pools.append(server)
 
         payload = {
-            'type': self.target_type,
-            'resource': self.target,
+            'type': resource.target_type,
+            'resource': resource.target,
             'command': 'bind',
             'identifier': identifier
         }
         server.connection.write(misc.serialize(payload) + b';')
         await server.connection.flush()
 
-        await self.__pool_passthrough(server)
+        await self.__pool_passthrough(resource, server)
 
-    def __get_pool(self):
-        count = len(self.pools)
-        if count == 0: return None
-        self.pool_index = index = (self.pool_index + 1) % count
-        return self.pools[index]
+    def next_reconnect_delay(self):
+        self.reconnect_delay = min(RECONNECT_MAX_DELAY, max(RECONNECT_MIN_DELAY, self.reconnect_delay * 2))
+        return self.reconnect_delay * random.uniform(0.5, 1)
     
-    async def __pool_passthrough(self, reader: SocketClient):
+    async def __pool_passthrough(self, resource: TunnelResource, reader: SocketClient):
         rd = reader.connection
         if not rd: return
         try:
@@ -301,23 +428,26 @@ class TunnelClient:
                 payload = bytes.fromhex(data['payload'])
                 host = data['source_host']
                 port = data['source_port']
-                await self.__handle_pool_message(payload, host, port)
+                await self.__handle_pool_message(resource, payload, host, port)
         except Exception:
             pass
         finally:
             if reader.connection: reader.connection.close()
+            try: resource.pools.remove(reader)
+            except Exception: pass
 
-    async def __handle_pool_message(self, payload: bytes, host: str, port: int):
-        session = await self.udp_sessions.get(host, port)
-        await session.send((self.app_host, self.app_port), payload)
+    async def __handle_pool_message(self, resource: TunnelResource, payload: bytes, host: str, port: int):
+        if not resource.udp_sessions: return
+        session = await resource.udp_sessions.get(host, port)
+        await session.send((resource.app_host, resource.app_port), payload)
 
-    async def __handle_session_message(self, payload: bytes, addr: AddrType, session: UDPSession, retries = 3):
-        pool = self.__get_pool()
+    async def __handle_session_message(self, resource: TunnelResource, payload: bytes, addr: AddrType, session: UDPSession, retries = 3):
+        pool = resource.get_pool()
         if not pool or not pool.connection:
             if retries > 0:
                 logger.warning(f'Pool not found to handle message ({retries - 1} retries left)')
                 await asyncio.sleep(5)
-                await self.__handle_session_message(payload, addr, session, retries - 1)
+                await self.__handle_session_message(resource, payload, addr, session, retries - 1)
                 return
             logger.error('Pool not found and unable to process message!')
             return
@@ -329,26 +459,7 @@ class TunnelClient:
             'payload': payload.hex()
         }) + b';'
 
-        pool.connection.write(event)
-
-    async def __passthrough(self, reader: SocketClient, writer: SocketClient):
-        rd = reader.connection
-        wr = writer.connection
-        if not rd or not wr: return
-
-        try:
-            while True:
-                data = await rd.read_size(5125)
-                if not data:
-                    break
-                if not writer.connection:
-                    raise Exception('Writer has no connection')
-                wr.write(data)
-        except Exception:
-            pass
-        finally:
-            if reader.connection: reader.connection.close()
-            if writer.connection: writer.connection.close()
+        pool.connection.write_frame(event)
 
     async def __watchdog(self):
         while True:
@@ -366,18 +477,26 @@ class TunnelClient:
             sleep_duration += 1
             await asyncio.sleep(sleep_duration)
 
+    async def __report(self):
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            pools = [resource.app_pool for resource in self.resources] + list(self.bridge_pools.values())
+            pooled = {key: sum(pool.stats[key] for pool in pools) for key in ['warm', 'cold', 'discarded']}
+            logger.debug(f'Connections: {pooled["warm"]} warm, {pooled["cold"]} cold, {pooled["discarded"]} discarded, app dials {APP_DIAL_STATS["failed"]} failed and {APP_DIAL_STATS["timeout"]} timed out')
+            logger.debug(f'TLS handshakes: {TLS_HANDSHAKES["full"]} full, {TLS_HANDSHAKES["resumed"]} resumed, DNS: {DNS_STATS["hits"]} hits, {DNS_STATS["misses"]} misses, {DNS_STATS["failures"]} failures')
+
     def __registerDataTime(self):
         self.last_data = datetime.datetime.now()
 
 async def main():
+    loaded_argv = misc.load_argv(sys.argv)
+
     logging.basicConfig(
-        level=logging.INFO,
+        level=misc.log_level(loaded_argv.get('logLevel', None) or os.getenv('LOG_LEVEL', None)),
         format='%(asctime)s [%(name)s] %(levelname)s: %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
     )
 
-    loaded_argv = misc.load_argv(sys.argv)
-
     if 'help' in loaded_argv or len(loaded_argv.keys()) == 0:
         print('\n'.join([
             'py tunnelClient.py {args}',
@@ -393,29 +512,46 @@ async def main():
             '--serverTarget: Public port/host to link',
             '--serverAuth: password of public target',
             '--bridgePort: Port the server run the bridge service at (default 9000)',
-            '--pools: Amount of pools used to handle UDP connections (default 1)'
+            '--bridgePool: Idle bridge connections to the server shared by all resources, visitors skip the connect/TLS handshake (default 0, disabled)',
+            '--pools: Amount of pools used to handle UDP connections (default 1)',
+            '--appPool: Idle connections kept open to the app so visitors skip the connect/TLS handshake (default 0, disabled)',
+            '--appMaxConnections: Max concurrent visitor connections to the app, more visitors wait for a free slot (default 0, unlimited)',
+            '--socketProfile: default/interactive/bulk socket tuning preset for the app and bridge connections (default: default)',
+            '--noDelay, --sndBuf, --rcvBuf, --keepAlive (idle;interval;count), --fastOpen, --notSentLowat: override single socket options of the profile',
+            '--weight: Share of visitors for this client when the resource is load balanced (default 1)',
+            '--config: CSV file with one resource per row to bind several resources in one process (replaces the app* and serverTarget/serverAuth args)',
+            '--frameWindow: Microseconds to hold small control frames so bursts go out in one write (default 0, frames of the same loop iteration)',
+            '--eventLoop: auto/asyncio/uvloop, auto uses uvloop when installed (default auto)',
+            '--logLevel: debug/info/warning/error, debug adds the periodic connection, TLS and DNS statistics (default info)'
         ]))
         return
 
-    app_type = loaded_argv.get('appType', '')
-    local_host = loaded_argv.get('appHost', '')
-    local_port = loaded_argv.get('appPort', '')
-    app_ssl = loaded_argv.get('appSSL', '0') == '1'
-    app_ssl_unsafe = loaded_argv.get('appSSLUnsafe', '0') == '1'
     server_host = loaded_argv.get('serverHost', '')
     bridge_port = loaded_argv.get('bridgePort', '9000')
-    server_target = loaded_argv.get('serverTarget', '')
-    server_auth = loaded_argv.get('serverAuth', '')
     server_ssl = loaded_argv.get('serverSSL', '0') == '1'
     server_ssl_unsafe = loaded_argv.get('serverSSLUnsafe', '0') == '1'
-    app_auth = loaded_argv.get('appAuth', '')
-    pool_count = loaded_argv.get('pools', '')
+    config = loaded_argv.get('config', None)
 
-    tc = TunnelClient(
-        server_host, bridge_port, server_ssl, server_ssl_unsafe,
-        local_host, local_port, app_ssl, app_ssl_unsafe,
-        app_type, server_target, server_auth, app_auth, pool_count
-    )
+    rows = CSVReader(Path(config)).data if config else [loaded_argv]
+    if config and len(rows) == 0:
+        logger.error(f'No resources found in {config}')
+        return
+
+    try:
+        resources = [TunnelResource(
+            row.get('appHost', ''), row.get('appPort', ''), row.get('appSSL', '0') == '1', row.get('appSSLUnsafe', '0') == '1',
+            row.get('appType', ''), row.get('serverTarget', ''), row.get('serverAuth', ''), row.get('appAuth', ''), row.get('pools', ''), row.get('weight', ''),
+            row.get('appPool', ''), row.get('appMaxConnections', ''), SocketOptions.parse(row)
+        ) for row in rows]
+        tc = TunnelClient(server_host, bridge_port, server_ssl, server_ssl_unsafe, resources, loaded_argv.get('bridgePool', ''))
+    except (QuitException, ValueError) as e:
+        logger.error(str(e))
+        return
+
+    set_coalesce_window(misc.to_int(loaded_argv.get('frameWindow', None), None))
+    misc.queue_task(eventLoop.monitor_lag())
+    fdBudget.raise_limit()
+    misc.queue_task(fdBudget.monitor())
     while True:
         try:
             await tc.start()
@@ -423,8 +559,9 @@ async def main():
             logger.info(f'Tunnel client closed (quitting), err: {str(e)}')
             break
         except Exception as e:
-            logger.warning(f'Tunnel client interrupted (restarting in 10s), err: {str(e)}')
-            await asyncio.sleep(10)
+            delay = tc.next_reconnect_delay()
+            logger.warning(f'Tunnel client interrupted (restarting in {delay:.2f}s), err: {str(e)}')
+            await asyncio.sleep(delay)
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    eventLoop.run(main(), misc.load_argv(sys.argv).get('eventLoop', None))
@@ -1,38 +1,48 @@
-import asyncio, sys, os, hashlib, logging
-from helpers import CSVReader, SocketWrapper, misc, create_host
-from genericHost import GenericHost
+import asyncio, sys, os, logging, typing
+from helpers import CSVReader, SocketWrapper, secretHash, eventLoop, taskScope, fdBudget, ControlChannel, TLSServerContext, FileWatcher, misc, create_host
+from helpers.socketWrapper import set_coalesce_window, FRAME_STATS
+from helpers.relay import RELAY_STATS
+from pathlib import Path
+from genericHost import GenericHost, PING_INTERVAL, PING_TIMEOUT, REQUEST_STATS
+from resourceStore import ResourceStore, ResourceIndex, CSVResourceStore, SQLiteResourceStore, RESOURCE_EVICT_INTERVAL
 from handlers import TcpProtocolHandler, HttpProtocolHandler, UdpProtocolHandler
 from DTLAuth.setupDTLAuth import setupDTLAuth
+from DTLAuth.utils import AUTH_STATS
 
 logger = logging.getLogger(__name__)
 
 class TunnelHost:
-    def __init__(self, csvReader: CSVReader, parsed_argv: dict[str, str]):
-        self.__tcps: list[GenericHost] = []
-        self.__https: list[GenericHost] = []
-        self.__udps: list[GenericHost] = []
+    def __init__(self, store: ResourceStore, parsed_argv: dict[str, str]):
+        self.__tcps = ResourceIndex('tcp', store)
+        self.__https = ResourceIndex('http', store)
+        self.__udps = ResourceIndex('udp', store)
 
         self.tcp_server_port = misc.to_int(parsed_argv.get('tcpPort', None), None) or misc.to_int(os.getenv('TCP_SERVER_PORT', None), None) or 9000
         self.http_server_port = misc.to_int(parsed_argv.get('httpPort', None), None) or misc.to_int(os.getenv('HTTP_SERVER_PORT', None), None) or 8000
+        self.https_server_port = misc.to_int(parsed_argv.get('httpsPort', None), None) or misc.to_int(os.getenv('HTTPS_SERVER_PORT', None), None)
+        self.tcp_server_tls = (parsed_argv.get('tcpTLS', None) or os.getenv('TCP_SERVER_TLS', '0')) == '1'
 
         misc.validate_port(self.tcp_server_port)
         misc.validate_port(self.http_server_port)
+        if self.https_server_port is not None: misc.validate_port(self.https_server_port)
 
-        if self.tcp_server_port == self.http_server_port:
-            raise ValueError('TCP and HTTP port can\'t be the same')
+        ports = [port for port in [self.tcp_server_port, self.http_server_port, self.https_server_port] if port is not None]
+        if len(set(ports)) != len(ports):
+            raise ValueError('TCP, HTTP and HTTPS port can\'t be the same')
 
-        self.__tcp_server = create_host('0.0.0.0', self.tcp_server_port, self.__on_tcp_access, None)
-        self.__http_server = create_host('0.0.0.0', self.http_server_port, self.__on_http_access, None)
+        self.__resources = [self.__tcps, self.__https, self.__udps]
+
+        tls_cert = parsed_argv.get('tlsCert', None) or os.getenv('TLS_CERT', None)
+        tls_key = parsed_argv.get('tlsKey', None) or os.getenv('TLS_KEY', None)
+        tls_cert_dir = parsed_argv.get('tlsCertDir', None) or os.getenv('TLS_CERT_DIR', None)
+        self.tls = TLSServerContext(tls_cert, tls_key, tls_cert_dir, is_known=self.__https.known) if tls_cert or tls_cert_dir else None
 
-        for i in csvReader.data:
-            type_ = i['type']
-            con = i['con']
-            sha256hex = i['sha256hex']
-            salt = i['salt']
+        if (self.tcp_server_tls or self.https_server_port) and not self.tls:
+            raise ValueError('TLS listeners require --tlsCert or --tlsCertDir')
 
-            if type_ == 'tcp': self.__tcps.append(GenericHost('tcp', con, sha256hex, salt))
-            elif type_ == 'http': self.__https.append(GenericHost('http', con, sha256hex, salt))
-            elif type_ == 'udp': self.__udps.append(GenericHost('udp', con, sha256hex, salt))
+        self.__tcp_server = create_host('0.0.0.0', self.tcp_server_port, self.__on_tcp_access, None, ssl_context=self.tls.context if self.tls and self.tcp_server_tls else None, shed=False)
+        self.__http_server = create_host('0.0.0.0', self.http_server_port, self.__on_http_access, None)
+        self.__https_server = create_host('0.0.0.0', self.https_server_port, self.__on_https_access, None, ssl_context=self.tls.context) if self.tls and self.https_server_port else None
 
         self.__tcp_handler = TcpProtocolHandler(self.__tcps)
         self.__http_handler = HttpProtocolHandler(self.__https)
@@ -41,8 +51,34 @@ class TunnelHost:
     async def start(self):
         await self.__tcp_server.start()
         await self.__http_server.start()
-        logger.info(f'Started servers on ports: tcp={self.tcp_server_port}, http={self.http_server_port}')
+        if self.__https_server: await self.__https_server.start()
+        if self.tls: misc.queue_task(self.tls.watch())
+        misc.queue_task(self.evict_idle())
+        logger.info(f'Started servers on ports: tcp={self.tcp_server_port}{" (tls)" if self.tcp_server_tls else ""}, http={self.http_server_port}, https={self.https_server_port}')
     
+    async def reload(self, file: Path):
+        store = self.__https.store.reload(file)
+        updated = removed = 0
+
+        for resources in self.__resources:
+            resource_updated, resource_removed = await resources.apply(store)
+            updated += resource_updated
+            removed += resource_removed
+
+        logger.info(f'Resources reloaded: {updated} updated, {removed} removed')
+
+    async def evict_idle(self):
+        while True:
+            await asyncio.sleep(RESOURCE_EVICT_INTERVAL)
+            evicted = sum(resources.evict_idle() for resources in self.__resources)
+            if evicted: logger.info(f'Evicted {evicted} idle resources')
+            logger.debug(f'{taskScope.root.active} tasks running in {len(taskScope.root.children)} resource scopes')
+            logger.debug(f'{fdBudget.FD_STATS["open"]} of {fdBudget.FD_STATS["limit"]} file descriptors open, {fdBudget.FD_STATS["shed"]} connections shed')
+            hosts = [host for resources in self.__resources for host in resources.values()]
+            logger.debug(f'{sum(host.streams for host in hosts)} streams open ({sum(1 for host in hosts if host.max_streams and host.streams >= host.max_streams)} resources at maxStreams), {REQUEST_STATS["limited"]} requests limited, {RELAY_STATS["idle_closed"]} idle streams closed')
+            logger.debug(f'Requests: {REQUEST_STATS["rejected"]} rejected, {REQUEST_STATS["timed_out"]} timed out, {REQUEST_STATS["udp_dropped"]} UDP datagrams dropped, DTLAuth: {AUTH_STATS["accepted"]} accepted, {AUTH_STATS["rejected"]} rejected, {AUTH_STATS["limited"]} limited')
+            if FRAME_STATS['writes']: logger.debug(f'{FRAME_STATS["frames"] / FRAME_STATS["writes"]:.2f} control frames per write ({FRAME_STATS["urgent"]} urgent)')
+
     async def auth_request(self, ip: str, resourceType: str, resourceItem: str, resourceCode: str):
         if resourceType == 'tcp':
             return await self.__tcp_handler.auth_request(ip, resourceItem, resourceCode)
@@ -50,16 +86,25 @@ class TunnelHost:
             return await self.__http_handler.auth_request(ip, resourceItem, resourceCode)
         elif resourceType == 'udp':
             return await self.__udp_handler.auth_request(ip, resourceItem, resourceCode)
-        return False 
+        return None
 
     async def __on_http_access(self, connection: SocketWrapper):
+        first_byte = await connection.peek(1)
+        if not first_byte:
+            connection.close()
+            return
+
+        if misc.is_tls_handshake(first_byte):
+            await self.__on_tls_passthrough(connection)
+            return
+
         headers = await misc.http_identification(connection)
         domain = headers.get('host', None) if headers else None
         if not domain:
             connection.close()
             return
 
-        httpHost = misc.find_first(self.__https, lambda httpHost: httpHost.con == domain)
+        httpHost = self.__https.find(domain)
 
         if not isinstance(httpHost, GenericHost):
             connection.write(misc.http_response(f'<h1>Invalid host</h1><p>The host {domain} is invalid</p>').encode())
@@ -67,7 +112,27 @@ class TunnelHost:
             connection.close()
             return
         
-        misc.queue_task(httpHost.on_client(connection, headers=headers))
+        if not httpHost.tasks.spawn(httpHost.on_client(connection, headers=headers)): connection.close()
+
+    async def __on_tls_passthrough(self, connection: SocketWrapper):
+        domain = await misc.tls_identification(connection)
+        httpHost = self.__https.find(domain) if domain else None
+
+        if not isinstance(httpHost, GenericHost):
+            connection.close()
+            return
+
+        if not httpHost.tasks.spawn(httpHost.on_client(connection)): connection.close()
+
+    async def __on_https_access(self, connection: SocketWrapper):
+        domain = self.tls.server_name(connection.writer.get_extra_info('ssl_object')) if self.tls else None
+        httpHost = self.__https.find(domain) if domain else None
+
+        if not isinstance(httpHost, GenericHost):
+            await self.__on_http_access(connection)
+            return
+
+        if not httpHost.tasks.spawn(httpHost.on_client(connection)): connection.close()
 
     async def __on_tcp_access(self, connection: SocketWrapper):
         stream = await connection.read_until(b';')
@@ -79,12 +144,20 @@ class TunnelHost:
             connection.close()
             return
 
-        if not isinstance(parsed, dict) or not 'type' in parsed or not 'resource' in parsed or not 'command' in parsed:
+        if not isinstance(parsed, dict) or not 'command' in parsed:
             connection.close()
             return
         
         command = parsed['command']
 
+        if command == 'authenticate_many':
+            await self.__handle_tcp_authenticate_many(parsed, connection)
+            return
+
+        if not 'type' in parsed or not 'resource' in parsed:
+            connection.close()
+            return
+
         if command == 'authenticate':
             await self.__handle_tcp_authenticate(parsed, connection)
         elif command == 'bind':
@@ -100,12 +173,50 @@ class TunnelHost:
         if data['type'] == 'tcp':
             await self.__tcp_handler.authenticate(data, connection)
         elif data['type'] == 'http':
+            self.__preload_certificate(data['type'], data['resource'])
             await self.__http_handler.authenticate(data, connection)
         elif data['type'] == 'udp':
             await self.__udp_handler.authenticate(data, connection)
         else:
             connection.close()
 
+    async def __handle_tcp_authenticate_many(self, data: dict, connection: SocketWrapper):
+        resources = data.get('resources', None)
+        if not isinstance(resources, list):
+            connection.close()
+            return
+
+        channel = ControlChannel(connection, PING_INTERVAL, PING_TIMEOUT)
+        tasks = []
+        for item in resources:
+            if not isinstance(item, dict) or not 'type' in item or not 'resource' in item or not 'secret' in item:
+                continue
+
+            handler = self.__get_handler(item['type'])
+            if not handler or not handler.find_resource(item['resource']):
+                connection.write_frame(misc.serialize({'code': 'RESOURCE_NOT_FOUND', 'message': f'The {item["type"]} {item["resource"]} does not exist', 'type': item['type'], 'resource': item['resource']}) + b';')
+                continue
+
+            self.__preload_certificate(item['type'], item['resource'])
+            tasks.append(handler.authenticate(item, channel.open(item['type'], item['resource'])))
+
+        await connection.flush()
+        if len(tasks) == 0:
+            connection.close()
+            return
+
+        await asyncio.gather(channel.listen(), *tasks)
+
+    def __preload_certificate(self, resource_type: str, resource: typing.Any):
+        if self.tls and self.tls.cert_dir and resource_type == 'http' and isinstance(resource, str) and self.__https.known(resource):
+            misc.queue_task(self.tls.preload(resource))
+
+    def __get_handler(self, resource_type: str):
+        if resource_type == 'tcp': return self.__tcp_handler
+        elif resource_type == 'http': return self.__http_handler
+        elif resource_type == 'udp': return self.__udp_handler
+        return None
+
     async def __handle_tcp_bind(self, data: dict, connection: SocketWrapper):
         if not 'identifier' in data:
             connection.close()
@@ -123,31 +234,54 @@ class TunnelHost:
             connection.close()
 
 async def main():
+    parsed_argv = misc.load_argv(sys.argv)
+
     logging.basicConfig(
-        level=logging.INFO,
+        level=misc.log_level(parsed_argv.get('logLevel', None) or os.getenv('LOG_LEVEL', None)),
         format='%(asctime)s [%(name)s] %(levelname)s: %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
     )
 
-    parsed_argv = misc.load_argv(sys.argv)
-
     if parsed_argv.get('sha256gen', None) == '1':
         auth = parsed_argv.get('auth', '')
         salt = parsed_argv.get('salt', '')
         if not auth or not salt:
             print('--auth or --salt missing')
             return
-        full_auth = (auth + salt).encode('utf-8')
-        print(hashlib.sha256(full_auth).hexdigest() + '\n')
+        kdf = parsed_argv.get('kdf', secretHash.KDF_SHA256)
+        params = parsed_argv.get('kdfParams', secretHash.DEFAULT_PARAMS.get(kdf, ''))
+        try: secretHash.validate(kdf, params)
+        except ValueError as e:
+            print(str(e))
+            return
+        print(secretHash.derive(auth, salt, kdf, params) + '\n')
+        if kdf != secretHash.KDF_SHA256: print(f'kdf={kdf}, kdfParams={params}\n')
         return
 
-    file = misc.get_file('tunnel_servers.csv')
-    csvReader = CSVReader(file)
-    th = TunnelHost(csvReader, parsed_argv)
+    resource_db = parsed_argv.get('resourceDB', None) or os.getenv('RESOURCE_DB', None)
+    if resource_db:
+        file = Path(resource_db)
+        store = SQLiteResourceStore(file)
+        import_csv = parsed_argv.get('importCSV', None)
+        if import_csv:
+            count = store.import_csv(CSVReader(Path(import_csv)))
+            print(f'Imported {count} resources into {resource_db}')
+            return
+    else:
+        file = misc.get_file('tunnel_servers.csv')
+        store = CSVResourceStore(CSVReader(file))
+
+    set_coalesce_window(misc.to_int(parsed_argv.get('frameWindow', None), None) or misc.to_int(os.getenv('FRAME_WINDOW', None), None))
+    misc.queue_task(eventLoop.monitor_lag())
+    fdBudget.raise_limit()
+    misc.queue_task(fdBudget.monitor())
+    th = TunnelHost(store, parsed_argv)
     await th.start()
+    misc.queue_task(FileWatcher(file, th.reload).watch())
+    misc.queue_task(FileWatcher(misc.get_file('http_ip_headers.csv'), misc.reload_ip_headers).watch())
     logger.info('Tunnel host started')
     await setupDTLAuth(parsed_argv, th.auth_request)
     await misc.run_forever()
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    eventLoop.run(main(), misc.load_argv(sys.argv).get('eventLoop', None))